@@ -1,27 +1,267 @@
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import os
-
-
-def read_file(path: str) -> pd.DataFrame:
+import re
+import glob
+import json
+import mmap
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import repeat
+from typing import Iterator, Union
+from pandas.api.types import union_categoricals
+from contextlib import nullcontext
+
+import breach_entities
+import breach_profiling
+import breach_search
+from breach_profiling import stage
+
+
+# Precedence-ordered (pattern, category) rules used by fix_columns(). A raw value is assigned the category of the
+# first rule whose pattern occurs anywhere in it, so 'Improper Disposal, Loss, Theft' becomes 'Improper Disposal'.
+BREACH_TYPE_RULES = (
+    ('Hacking/IT Incident', 'Hacking/IT Incident'),
+    ('Improper Disposal', 'Improper Disposal'),
+    ('Loss', 'Loss'),
+    ('Unauthorized Access/Disclosure', 'Unauthorized Access/Disclosure'),
+    ('Theft', 'Theft'),
+    ('Unknown', 'Other/Unknown'),
+    ('Other', 'Other/Unknown'),
+)
+
+# 'Paper' is checked before 'Other', so 'Other, Paper/Films' is counted as 'Paper'.
+BREACH_LOCATION_RULES = (
+    ('Desktop Computer', 'Desktop Computers'),
+    ('Electronic Medical Record', 'Electronic health records'),
+    ('Email', 'E-mail'),
+    ('Laptop', 'Laptops'),
+    ('Network Server', 'Network Servers'),
+    ('Paper', 'Paper'),
+    ('Other', 'Others'),
+)
+
+# Maps each raw column to the name of the cleaned column and the rule table that produces it.
+COLUMN_RULES = {
+    'Type of Breach': ('Type of Breach', BREACH_TYPE_RULES),
+    'Location of Breached Information': ('Location of Breach', BREACH_LOCATION_RULES),
+}
+
+# The date formats read_file() tries, in order, when it is not told the format of 'Breach Submission Date'.
+DATE_FORMATS = ('%m/%d/%y', '%m/%d/%Y', '%Y-%m-%d')
+
+# Bump this whenever cleanup() changes in a way that the rule tables don't capture, so cached datasets are rebuilt.
+CLEANUP_VERSION = 4
+
+# Where load_dataset() keeps the cleaned datasets, relative to this file.
+CACHE_DIR = '.breach_cache'
+
+# The options every part of the breach report is read with.
+CSV_OPTIONS = {'encoding': 'latin1', 'dtype': {'Type of Breach': 'string'}}
+
+# The columns that identify a breach. A row appended to the file with the same values in these columns as a row that
+# update_dataset() read before is taken to be an amended version of that breach, and replaces it. The report has no id
+# of its own and does list separate breaches of the same covered entity on the same day, some of them with the same
+# values in all of these columns, so rows that are read together never replace each other.
+ROW_KEY = ['Name of Covered Entity', 'State', 'Breach Submission Date', 'Type of Breach',
+           'Location of Breached Information']
+
+# The aggregate tables built by aggregate_tables() and stream_aggregates(), and the columns each of them is grouped by.
+AGGREGATE_DIMENSIONS = {
+    'Type of Breach': ['Type of Breach'],
+    'Location of Breach': ['Location of Breach'],
+    'State': ['State'],
+    'Month': ['Year', 'Month'],
+}
+
+# The columns that are summed up in every aggregate table, next to the number of breaches.
+AGGREGATE_SUMS = ['Individuals Affected', 'Business Associate Present', 'Covered Entities Involved']
+
+# The figures and tables render_report() produces by default, as (name, analysis function, arguments). These are the
+# same analyses the script shows when it is run without --report.
+REPORT_ANALYSES = (
+    ('type_of_breach', 'analyze_column', ('Type of Breach', '2013-09-22')),
+    ('location_of_breach', 'analyze_column', ('Location of Breach', '2013-09-22')),
+    ('seasonal', 'plot_seasonal', ('2022-09-22',)),
+    ('trends', 'check_trends', ('2022-09-22',)),
+    ('state_location', 'analyze_multi_column', ('State', 'Location of Breach', '2022-09-22')),
+    ('state_type', 'analyze_multi_column', ('State', 'Type of Breach', '2022-09-22')),
+)
+
+# The columns the aggregate cube is grouped by. The cube is grouped by month rather than by day, so that it stays much
+# smaller than the data; rollup_cube() takes the breaches in the months a timeframe only partly covers from the data.
+CUBE_DIMENSIONS = ['Year', 'Month', 'State', 'Type of Breach', 'Location of Breach']
+
+# The columns compact_frame() stores as categoricals. They only have a few distinct values each, so every row just
+# keeps a small code instead of its own string. Both the raw and the cleaned names are listed, so that a dataframe can
+# be compacted before or after cleanup().
+CATEGORY_COLUMNS = ['State', 'Covered Entity Type', 'Business Associate Present', 'Type of Breach',
+                    'Location of Breached Information', 'Location of Breach', 'Entity']
+
+# The column store_descriptions() leaves in place of 'Web Description', which tells cleanup() whether a breach has one.
+DESCRIPTION_FLAG = 'Has Web Description'
+
+
+@stage
+def read_file(path: str, chunksize: int = None, date_format: str = None) -> Union[pd.DataFrame,
+                                                                                Iterator[pd.DataFrame]]:
     """
     This function helps us read the file in. The path can be specified in the function call in the main() function and
-    this function returns the dataframe.
+    this function returns the dataframe. If a chunk size is given, the file is not loaded all at once, and an iterator
+    over dataframes of that many rows is returned instead (see stream_aggregates()). The submission dates are parsed by
+    parse_dates(), and the number of dates that could not be parsed is kept in df.attrs['coerced_dates'].
     :param path: The path of the file in the user's system.
-    :return: The dataframe.
+    :param chunksize: The number of rows in each chunk, or None to read the whole file.
+    :param date_format: The format of the submission dates. If it is not given, it is detected from the file.
+    :return: The dataframe, or an iterator over the chunks of the dataframe.
     """
 
-    absolute_path = os.path.dirname(__file__)
-    relative_path = path
-    final_path = os.path.join(absolute_path, relative_path)
+    final_path = _full_path(path)
+
+    df = pd.read_csv(final_path, chunksize=chunksize, **CSV_OPTIONS)
+
+    if chunksize is not None:
+        return _parse_chunks(df, date_format)
+
+    return _parse_submission_dates(df, date_format)
+
+
+def _parse_chunks(chunks: Iterator[pd.DataFrame], date_format: str = None) -> Iterator[pd.DataFrame]:
+    """
+    Parses the submission dates of every chunk as it is read. The date format is detected from the first chunk and
+    then reused for the rest of them.
+
+    :param chunks: The chunks returned by pd.read_csv().
+    :param date_format: The format of the submission dates, if it is known.
+    :return: An iterator over the chunks with the parsed dates.
+    """
+    for chunk in chunks:
+        chunk = _parse_submission_dates(chunk, date_format)
+        date_format = chunk.attrs['date_format']
+        yield chunk
+
+
+def _parse_submission_dates(df: pd.DataFrame, date_format: str = None) -> pd.DataFrame:
+    """
+    Replaces the 'Breach Submission Date' column with the parsed dates, and records the format and the number of dates
+    that could not be parsed in df.attrs.
 
-    d_parser = lambda x: pd.to_datetime(x, errors='coerce')
-    df = pd.read_csv(final_path, encoding='latin1', dtype={'Type of Breach': 'string'},
-                     parse_dates=['Breach Submission Date'], date_parser=d_parser)
+    :param df: The dataframe as it was read from the file.
+    :param date_format: The format of the submission dates, if it is known.
+    :return: The dataframe with the parsed dates.
+    """
+    values = df['Breach Submission Date']
+    if date_format is None:
+        date_format = detect_date_format(values)
+
+    df['Breach Submission Date'], coerced = parse_dates(values, date_format)
+    df.attrs['date_format'] = date_format
+    df.attrs['coerced_dates'] = coerced
+    if coerced:
+        print("{} submission dates could not be parsed and were set to NaT.".format(coerced))
 
     return df
 
 
+def detect_date_format(values: pd.Series, sample_size: int = 100) -> str:
+    """
+    Finds the format in DATE_FORMATS that most of a sample of the distinct values are written in, or the first one of
+    them if several fit as many values. A few malformed values don't keep the format from being found, since
+    parse_dates() parses the values that don't fit it one by one anyway.
+
+    :param values: The dates, as strings.
+    :param sample_size: The number of distinct values that are checked.
+    :return: The format, or None if none of the formats fit more than half of the sample.
+
+    >>> detect_date_format(pd.Series(['10/21/09', '1/5/10', None]))
+    '%m/%d/%y'
+    >>> detect_date_format(pd.Series(['10/21/09', '1/5/10', 'unknown']))
+    '%m/%d/%y'
+    >>> detect_date_format(pd.Series(['2009-10-21', '2010-01-05']))
+    '%Y-%m-%d'
+    >>> detect_date_format(pd.Series(['October 21, 2009'])) is None
+    True
+    """
+    sample = pd.Series(values.dropna().unique()[:sample_size], dtype=object)
+    if sample.empty:
+        return None
+
+    fits = [pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum() for date_format in DATE_FORMATS]
+    best = int(np.argmax(fits))
+    return DATE_FORMATS[best] if 2 * fits[best] > len(sample) else None
+
+
+@stage
+def parse_dates(values: pd.Series, date_format: str = None) -> tuple:
+    """
+    This function converts a column of dates from strings to datetimes. Each distinct string is only parsed once, and
+    the results are mapped back to the rows. The strings are parsed with the given format first, and any that don't
+    match it are parsed one by one by pd.to_datetime(), so a date is only set to NaT if pd.to_datetime() can't parse it
+    either, just like when every value was parsed on its own.
+
+    :param values: The dates, as strings.
+    :param date_format: The format the dates are expected to be in.
+    :return: The parsed dates, and the number of dates that could not be parsed (not counting the missing ones).
+
+    >>> dates, coerced = parse_dates(pd.Series(['10/21/09', '10/21/09', 'October 28, 2009', 'unknown', None]), '%m/%d/%y')
+    >>> dates
+    0   2009-10-21
+    1   2009-10-21
+    2   2009-10-28
+    3          NaT
+    4          NaT
+    dtype: datetime64[ns]
+    >>> coerced
+    1
+    """
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+
+    if date_format is None:
+        parsed = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+    else:
+        parsed = pd.to_datetime(uniques, format=date_format, errors='coerce')
+
+    failed = parsed.isna()
+    if failed.any():
+        parsed[failed] = [pd.to_datetime(value, errors='coerce') for value in uniques[failed]]
+
+    # The last element is used for the missing values, whose code is -1.
+    lookup = np.append(parsed.to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT', 'ns'))
+    dates = pd.Series(lookup[codes], index=values.index, name=values.name)
+
+    coerced = int((dates.isna() & values.notna()).sum())
+    return dates, coerced
+
+
+def _full_path(path: str) -> str:
+    """
+    Returns the path of a file relative to the folder this script is in, so that the script can be run from anywhere.
+
+    :param path: The path of the file, relative to this script.
+    :return: The full path of the file.
+    """
+    absolute_path = os.path.dirname(__file__)
+    return os.path.join(absolute_path, path)
+
+
+def file_stat(path: str) -> os.stat_result:
+    """
+    Returns the status of a file, such as its size and modification time, with its path relative to this script like
+    the other functions take it.
+
+    :param path: The path of the file, relative to this script.
+    :return: The result of os.stat().
+    """
+    return os.stat(_full_path(path))
+
+
+@stage
 def adjust_time_limits(df: pd.DataFrame, end: str = '2013-09-22', start: str = '2009-01-01') -> pd.DataFrame:
     """
     This function helps us extract the breaches between any two dates we desire.
@@ -60,6 +300,7 @@ def adjust_time_limits(df: pd.DataFrame, end: str = '2013-09-22', start: str = '
     return df
 
 
+@stage
 def cleanup(df: pd.DataFrame) -> pd.DataFrame:
     """
     This function 'cleans' the dataframe. First, it removes the null values, and then 'fixes' a few columns by calling
@@ -68,6 +309,9 @@ def cleanup(df: pd.DataFrame) -> pd.DataFrame:
     want to see the seasonal trends in a desired date range and look at the analysis of a different date range
     entirely. Hence, the original dataframe is passed into those four functions (analyze_column(), plot_seasonal(),
     check_trends() and analyze_multi_columns()) and each of those functions call the cleanup() function individually.
+    When the same data is analyzed many times, prepare_dataset() or load_dataset() can be used to clean it only once.
+    If the descriptions have already been moved out of the dataframe by store_descriptions(), the breaches without one
+    are found from the DESCRIPTION_FLAG column instead, which is then dropped.
 
     :param df: The original, unprocessed dataframe.
     :return: The cleaned, processed dataframe.
@@ -94,30 +338,33 @@ def cleanup(df: pd.DataFrame) -> pd.DataFrame:
     #print("Number of null values in each column: \n{}\n".format(df.isna().sum(axis=0)))
     #print("Percentage of null values in each column (before cleanup): \n{}".format(
     #    round(df.isna().sum() * 100 / len(df), 2)))
-    df = df.dropna(subset=['State', 'Covered Entity Type', 'Individuals Affected', 'Type of Breach',
-                           'Location of Breached Information', 'Web Description'])
+    required = ['State', 'Covered Entity Type', 'Individuals Affected', 'Type of Breach',
+                'Location of Breached Information', 'Web Description']
+    if DESCRIPTION_FLAG in df.columns and 'Web Description' not in df.columns:
+        df = df.loc[df[DESCRIPTION_FLAG]].drop(columns=[DESCRIPTION_FLAG])
+        required.remove('Web Description')
+    df = df.dropna(subset=required)
 
     df = fix_columns(df, 'Type of Breach')
 
     df = fix_columns(df, 'Location of Breached Information')
 
-    df['Business Associate Present'] = df.apply(
-        lambda dataset: change_to_binary(dataset, 'Business Associate Present'),
-        axis=1)
+    df['Business Associate Present'] = column_to_binary(df, 'Business Associate Present')
 
-    df['Covered Entities Involved'] = df.apply(lambda dataset: change_to_binary(dataset, 'Covered Entity Type'),
-                                               axis=1)
+    df['Covered Entities Involved'] = column_to_binary(df, 'Covered Entity Type')
 
     return df
 
 
+@stage
 def change_to_binary(df: pd.DataFrame, column_name: str) -> int:
     """
     The purpose of this function is to change the values of certain columns from string to binary, for the purpose of
     understanding and analyzing the aggregations. 'Covered Entity Type' and 'Business Associate Present' both are
     string values, and need to be converted to integer values. To do this, a 1 is returned if a value exists in the
     'Covered Entity Type' column and a 0 if it doesn't have a value. If the value is a 'Yes' in the
-    'Business Associate Present' column, a 1 is returned, and a 0 is returned if the value is 'No'.
+    'Business Associate Present' column, a 1 is returned, and a 0 is returned if the value is 'No'. It is applied one
+    row at a time; cleanup() uses column_to_binary(), which converts the whole column at once in the same way.
 
     :param df: The dataframe containing the columns that need to be converted.
     :param column_name: The name of the column that needs to be converted.
@@ -152,7 +399,67 @@ def change_to_binary(df: pd.DataFrame, column_name: str) -> int:
             return 0
 
 
-def fix_columns(df: pd.DataFrame, column_name: str) -> pd.DataFrame:
+@stage
+def column_to_binary(df: pd.DataFrame, column_name: str) -> pd.Series:
+    """
+    This is the column-wise version of change_to_binary(). Instead of being called once for every row, it converts the
+    whole column at once and returns it with a compact dtype. In the 'Covered Entity Type' column, every value is
+    tested for truth like change_to_binary() does: None and '' become a 0 and anything else a 1, including a NaN, which
+    is truthy (cleanup() drops the rows without one before this is called). In the 'Business Associate Present' column,
+    'Yes' becomes a 1 and 'No' becomes a 0. Any other value is not recognized (change_to_binary() returns None for it),
+    so if the column has any of those, it is returned as a nullable 'Int8' column with <NA> in their place.
+
+    :param df: The dataframe containing the column that needs to be converted.
+    :param column_name: The name of the column that needs to be converted.
+    :return: The converted column, or None if the column cannot be converted.
+
+    >>> df = pd.DataFrame([[1,'Healthcare Provider'], [2,'Health Plan'], [3, ]], columns=["A", "Covered Entity Type"])
+    >>> column_to_binary(df, 'Covered Entity Type')
+    0    1
+    1    1
+    2    0
+    Name: Covered Entity Type, dtype: int8
+    >>> df = pd.DataFrame({'Covered Entity Type': ['A', np.nan, None, '']})
+    >>> column_to_binary(df, 'Covered Entity Type').tolist() == df.apply(lambda row: change_to_binary(row, 'Covered Entity Type'), axis=1).tolist()
+    True
+    >>> column_to_binary(df, 'Covered Entity Type').tolist()
+    [1, 1, 0, 0]
+
+    >>> df = pd.DataFrame([[1,'Yes'], [2,'No'], [3, 'Yes']], columns=["A", "Business Associate Present"])
+    >>> column_to_binary(df, 'Business Associate Present')
+    0    1
+    1    0
+    2    1
+    Name: Business Associate Present, dtype: int8
+
+    >>> df = pd.DataFrame([[1,'Yes'], [2,'Unsure'], [3, None]], columns=["A", "Business Associate Present"])
+    >>> column_to_binary(df, 'Business Associate Present')
+    0       1
+    1    <NA>
+    2    <NA>
+    Name: Business Associate Present, dtype: Int8
+    """
+    if column_name == 'Covered Entity Type':
+        truth = np.fromiter(map(bool, df[column_name].to_numpy(dtype=object)), dtype=bool, count=len(df))
+        return pd.Series(truth, index=df.index, name=column_name).astype('int8')
+
+    if column_name == 'Business Associate Present':
+        values = df[column_name]
+        yes = values.eq('Yes').fillna(False).astype(bool)
+        no = values.eq('No').fillna(False).astype(bool)
+        if (yes | no).all():
+            return yes.astype('int8')
+        binary = pd.Series(pd.NA, index=df.index, dtype='Int8', name=column_name)
+        binary[yes] = 1
+        binary[no] = 0
+        return binary
+
+    print("The column {} cannot be converted to binary.".format(column_name))
+    return None
+
+
+@stage
+def fix_columns(df: pd.DataFrame, column_name: str, rules: tuple = None, new_column_name: str = None) -> pd.DataFrame:
     """
     The function performs something like a 'cleanup' of the values in certain columns. For example, the column
     'Type of Breach' has overlapping values. The six unique values it is supposed to have are: Hacking/IT Incident,
@@ -163,10 +470,14 @@ def fix_columns(df: pd.DataFrame, column_name: str) -> pd.DataFrame:
     to fix this issue. We decided to use this function to do this.
 
     This function accepts the dataframe and the column name that needs to be 'cleaned' and creates a new column that
-    assigns a unique value from the old column (with the overlapping values) to each date breach.
+    assigns a unique value from the old column (with the overlapping values) to each date breach. The values are
+    assigned from a precedence-ordered rule table (see COLUMN_RULES), and each distinct value is only matched once, no
+    matter how many rows contain it. A different rule table can be passed in to clean any other column.
 
     :param df: This is the dataframe with the column that needs to be cleaned.
     :param column_name: This is the name of the column that needs to be cleaned.
+    :param rules: A (pattern, category) rule table to use instead of the one in COLUMN_RULES.
+    :param new_column_name: The name of the cleaned column. Defaults to the name of the original column.
     :return: A dataframe with a new column containing no overlapping and only unique values.
 
     >>> df = pd.DataFrame([[1,'Hacking/IT Incident, Theft'], [2,'Improper Disposal, Loss, Theft']], columns=["A", "Type of Breach"]) 
@@ -190,73 +501,1254 @@ def fix_columns(df: pd.DataFrame, column_name: str) -> pd.DataFrame:
        A      Type of Breach
     0  1         Theft, Loss
     1  2  Loss, Other, Theft
+
+    >>> df = pd.DataFrame([[1,'Ransomware, Email'], [2,'Phishing']], columns=["A", "Vector"])
+    >>> df = fix_columns(df, 'Vector', (('Ransomware', 'Malware'), ('Phishing', 'Social Engineering')), 'Attack')
+    >>> df.head()
+       A              Attack
+    0  1             Malware
+    1  2  Social Engineering
     """
 
-    if column_name == 'Type of Breach':
-        for x in df[column_name]:
-            if 'Hacking/IT Incident' in x:
-                df.loc[df[column_name] == x, 'Breach Type'] = 'Hacking/IT Incident'
-                continue
-            if 'Improper Disposal' in x:
-                df.loc[df[column_name] == x, 'Breach Type'] = 'Improper Disposal'
-                continue
-            if 'Loss' in x:
-                df.loc[df[column_name] == x, 'Breach Type'] = 'Loss'
-                continue
-            if 'Unauthorized Access/Disclosure' in x:
-                df.loc[df[column_name] == x, 'Breach Type'] = 'Unauthorized Access/Disclosure'
-                continue
-            if 'Theft' in x:
-                df.loc[df[column_name] == x, 'Breach Type'] = 'Theft'
-                continue
-            if 'Unknown' in x or 'Other' in x:
-                df.loc[df[column_name] == x, 'Breach Type'] = 'Other/Unknown'
-                continue
-        df.drop([column_name], axis=1, inplace=True)
-        df = df.rename(columns={'Breach Type': column_name})
-        return df
+    if rules is None:
+        if column_name not in df.columns or column_name not in COLUMN_RULES:
+            print("The column name is not one of the columns in the dataframe. Returning the unchanged dataframe.")
+            return df
+        new_column_name, rules = COLUMN_RULES[column_name]
 
-    if column_name == 'Location of Breached Information':
-        for x in df[column_name]:
-            if 'Desktop Computer' in x:
-                df.loc[df[column_name] == x, 'Location'] = 'Desktop Computers'
-                continue
-            if 'Electronic Medical Record' in x:
-                df.loc[df[column_name] == x, 'Location'] = 'Electronic health records'
-                continue
-            if 'Email' in x:
-                df.loc[df[column_name] == x, 'Location'] = 'E-mail'
-                continue
-            if 'Laptop' in x:
-                df.loc[df[column_name] == x, 'Location'] = 'Laptops'
-                continue
-            if 'Network Server' in x:
-                df.loc[df[column_name] == x, 'Location'] = 'Network Servers'
-                continue
-            if 'Other' in x:
-                df.loc[df[column_name] == x, 'Location'] = 'Others'
-            if 'Paper' in x:
-                df.loc[df[column_name] == x, 'Location'] = 'Paper'
-                continue
-        df.drop([column_name], axis=1, inplace=True)
-        df = df.rename(columns={'Location': 'Location of Breach'})
-        return df
+    if new_column_name is None:
+        new_column_name = column_name
+
+    # Every distinct raw value is matched once, and the result is broadcast back to the rows through the codes.
+    codes, uniques = pd.factorize(df[column_name])
+    categories = [match_rules(value, tuple(rules)) for value in uniques]
+    values = np.array(categories + [np.nan], dtype=object)[codes]
+
+    df = df.drop([column_name], axis=1)
+    df[new_column_name] = values
+    return df
+
+
+@lru_cache(maxsize=None)
+def _compile_rules(rules: tuple) -> tuple:
+    """
+    Compiles a rule table into a single regular expression that finds every pattern of the table in one pass, along
+    with the precedence of each pattern. The lookahead lets overlapping patterns match, and the alternatives are
+    ordered by precedence so that the highest ranked pattern wins when two of them start at the same position.
+
+    :param rules: The (pattern, category) rule table.
+    :return: The compiled matcher and a dictionary of pattern -> (rank, category).
+    """
+    ranks = {}
+    for rank, (pattern, category) in enumerate(rules):
+        ranks.setdefault(pattern, (rank, category))
+    matcher = re.compile('(?=({}))'.format('|'.join(re.escape(pattern) for pattern in ranks)))
+    return matcher, ranks
+
+
+def match_rules(value, rules: tuple):
+    """
+    Returns the category of the highest precedence rule whose pattern occurs in the value, or NaN if none of them do.
+
+    :param value: The raw value to be categorized.
+    :param rules: The precedence-ordered (pattern, category) rule table.
+    :return: The category of the value.
+
+    >>> match_rules('Other, Paper/Films', BREACH_LOCATION_RULES)
+    'Paper'
+    >>> match_rules('Theft, Unauthorized Access/Disclosure', BREACH_TYPE_RULES)
+    'Unauthorized Access/Disclosure'
+    >>> match_rules('Unknown', BREACH_LOCATION_RULES)
+    nan
+    """
+    if not isinstance(value, str):
+        return np.nan
+
+    matcher, ranks = _compile_rules(rules)
+    found = [ranks[match] for match in matcher.findall(value)]
+    if not found:
+        return np.nan
+    return min(found)[1]
+
+
+@stage
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function stores the dataframe in less memory without changing any of its values. The columns in
+    CATEGORY_COLUMNS that hold strings become categoricals, and 'Individuals Affected' becomes the smallest unsigned
+    integer type that holds it, as long as it has no missing or fractional values. It works on the dataframe returned
+    by read_file() as well as on the cleaned one.
+
+    :param df: The dataframe.
+    :return: The compacted dataframe.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 13.0], ['CA', 'Health Plan', 7.0]], columns=['State', 'Covered Entity Type', 'Individuals Affected'])
+    >>> compact_frame(df).dtypes
+    State                   category
+    Covered Entity Type     category
+    Individuals Affected       uint8
+    dtype: object
+    """
+    types = {column: 'category' for column in CATEGORY_COLUMNS
+             if column in df.columns and pd.api.types.is_string_dtype(df[column].dtype)}
+    df = df.astype(types)
+
+    if 'Individuals Affected' in df.columns and df['Individuals Affected'].dtype.kind == 'f':
+        df['Individuals Affected'] = pd.to_numeric(df['Individuals Affected'], downcast='unsigned')
+
+    return df
 
-    if column_name not in df.columns:
-        print("The column name is not one of the columns in the dataframe. Returning the unchanged dataframe.")
+
+@stage
+def add_entities(df: pd.DataFrame, entities: breach_entities.EntityIndex = None) -> pd.DataFrame:
+    """
+    This function adds the covered entity of every breach to the cleaned dataframe: the 'Entity ID' and the canonical
+    'Entity' name found by breach_entities.resolve_entities(), so that the breaches of an entity whose name is spelled
+    in different ways are counted together. Unlike the rest of the cleaning, the entity of a breach depends on the
+    other breaches, so it isn't done by cleanup(). A dataframe without 'Name of Covered Entity' is returned unchanged.
+
+    :param df: The cleaned dataframe.
+    :param entities: The entity index to find the entities in (see breach_entities.build_entity_index()), which has to
+    have all the names of the dataframe. By default, the entities are resolved over the dataframe itself.
+    :return: The dataframe with the 'Entity ID' and 'Entity' columns.
+
+    >>> df = pd.DataFrame([['Aetna', 'CT'], ['Aetna, Inc.', 'CT'], ['Apria Healthcare', 'CA']], columns=['Name of Covered Entity', 'State'])
+    >>> add_entities(df)
+      Name of Covered Entity State  Entity ID            Entity
+    0                  Aetna    CT          0             Aetna
+    1            Aetna, Inc.    CT          0             Aetna
+    2       Apria Healthcare    CA          1  Apria Healthcare
+    """
+    if 'Name of Covered Entity' not in df.columns:
         return df
+    if entities is None:
+        return df.assign(**breach_entities.resolve_entities(df['Name of Covered Entity'], df['State']))
+    return df.assign(**breach_entities.entity_labels(entities, df['Name of Covered Entity'], df['State']))
+
+
+@dataclass
+class TextStore:
+    """
+    The 'Web Description' of every breach, kept out of the dataframe by store_descriptions(). The descriptions are the
+    largest part of the data, but the analyses only need to know whether a breach has one, so they are only read, with
+    read_descriptions(), when they are asked for. They are written one after another as UTF-8, either to a file or to
+    a buffer in memory, and each distinct description is only written once.
+
+    path: The file the descriptions are in, relative to this script, or None if they are kept in the buffer.
+    bounds: The first and last (excluded) byte of the description of every row, indexed like the dataframe. A row
+    without a description starts at -1.
+    buffer: The descriptions, if they are not kept in a file.
+    """
+    path: str = None
+    bounds: pd.DataFrame = None
+    buffer: bytes = field(default=None, repr=False)
+
+
+@stage
+def store_descriptions(df: pd.DataFrame, path: str = None, store: TextStore = None) -> tuple:
+    """
+    This function moves the 'Web Description' column out of the dataframe into a text store, and replaces it with the
+    DESCRIPTION_FLAG column, which cleanup() uses to leave out the breaches without a description. If a store is given,
+    the descriptions are added to it instead of to a new one, so that the rows of a file can be stored as they are
+    read.
+
+    :param df: The dataframe, with its 'Web Description' column.
+    :param path: The file to write the descriptions to, relative to this script. If it is not given, they are kept in
+    memory.
+    :param store: The store to add the descriptions to.
+    :return: The dataframe without the descriptions, and the store.
+
+    >>> df = pd.DataFrame([['CA', 'Lost via Email'], ['NY', None], ['TX', 'Lost via Email']], columns=['State', 'Web Description'])
+    >>> df, store = store_descriptions(df)
+    >>> df
+      State  Has Web Description
+    0    CA                 True
+    1    NY                False
+    2    TX                 True
+    >>> store.buffer
+    b'Lost via Email'
+    >>> read_descriptions(store, [2, 1]).tolist()
+    ['Lost via Email', None]
+    >>> df, store = store_descriptions(pd.DataFrame({'Web Description': [None, None]}, index=[3, 4]), store=store)
+    >>> store.bounds.dtypes.tolist(), read_descriptions(store, [4, 0]).tolist()
+    ([dtype('int64'), dtype('int64')], [None, 'Lost via Email'])
+    """
+    if store is None:
+        store = TextStore(path, pd.DataFrame(columns=['start', 'end'], dtype='int64'), None if path else b'')
+        offset = 0
+    else:
+        offset = len(store.buffer) if store.path is None else _text_size(store.path)
+
+    codes, uniques = pd.factorize(df['Web Description'])
+    encoded = [str(value).encode('utf-8') for value in uniques]
+    lengths = np.fromiter(map(len, encoded), dtype='int64', count=len(encoded))
+    ends = offset + np.cumsum(lengths)
+    starts = ends - lengths
+
+    # The last element is used for the missing values, whose code is -1.
+    bounds = pd.DataFrame({'start': np.append(starts, -1)[codes], 'end': np.append(ends, -1)[codes]}, index=df.index)
+    store = TextStore(store.path, pd.concat([store.bounds, bounds]), store.buffer)
+
+    if store.path is None:
+        store.buffer += b''.join(encoded)
+    else:
+        with open(_full_path(store.path), 'ab' if offset else 'wb') as file:
+            file.write(b''.join(encoded))
+
+    flag = df['Web Description'].notna()
+    return df.drop(columns=['Web Description']).assign(**{DESCRIPTION_FLAG: flag}), store
+
+
+def read_descriptions(store: TextStore, rows: list = None) -> pd.Series:
+    """
+    Reads the descriptions of some of the rows from a text store. A stored file is memory-mapped, so only the parts of
+    it that hold those descriptions are read.
+
+    :param store: The text store.
+    :param rows: The index labels of the rows. By default, every row in the store.
+    :return: The descriptions, indexed by the rows.
+    """
+    bounds = store.bounds if rows is None else store.bounds.loc[rows]
+
+    if store.path is None:
+        texts = _slice_texts(store.buffer, bounds)
+    elif _text_size(store.path) == 0:
+        texts = _slice_texts(b'', bounds)
+    else:
+        with open(_full_path(store.path), 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            texts = _slice_texts(buffer, bounds)
+
+    return pd.Series(texts, index=bounds.index, name='Web Description', dtype=object)
+
+
+def _slice_texts(buffer, bounds: pd.DataFrame) -> list:
+    """
+    Cuts the descriptions out of the bytes of a text store.
+
+    :param buffer: The bytes the descriptions were written to.
+    :param bounds: The first and last (excluded) byte of each description.
+    :return: The descriptions, with None for the missing ones.
+    """
+    return [None if start < 0 else buffer[start:end].decode('utf-8')
+            for start, end in zip(bounds['start'].tolist(), bounds['end'].tolist())]
+
+
+def _text_size(path: str) -> int:
+    """
+    Returns the size of the file of a text store, or 0 if it hasn't been written yet.
+
+    :param path: The path of the file, relative to this script.
+    :return: The size in bytes.
+    """
+    final_path = _full_path(path)
+    return os.path.getsize(final_path) if os.path.exists(final_path) else 0
 
 
-def analyze_column(df: pd.DataFrame, column_name: str, end: str = '2013-09-22', start: str = '2009-01-01') -> None:
+@dataclass
+class PreparedDataset:
+    """
+    The breach data after it has been cleaned once by prepare_dataset(). The analysis functions accept this in place of
+    the dataframe returned by read_file(), and then only need to select the rows in the desired timeframe instead of
+    cleaning the whole dataframe again on every call.
+
+    data: The cleaned and compacted dataframe, sorted by 'Breach Submission Date' (breaches without a date are at the
+    end). It doesn't have the 'Web Description' column, which is kept in texts instead.
+    key: Identifies the source file and cleaning rules the data was built from (see dataset_key()).
+    cube: The aggregate cube of the data (see build_cube()), built the first time it is needed if it isn't given.
+    daily_sums: The running totals of every day built by daily_sums(), keyed by the column they are split by.
+    texts: The descriptions of the breaches in the data (see read_descriptions()).
+    search_index: The inverted index of the descriptions, which search_dataset() uses.
+    entities: The entity index of the names in the data, which update_dataset() resolves the names of new breaches
+    against.
+    """
+    data: pd.DataFrame
+    key: str = None
+    cube: pd.DataFrame = field(default=None, repr=False)
+    daily_sums: dict = field(default_factory=dict, repr=False)
+    texts: TextStore = field(default=None, repr=False)
+    search_index: breach_search.SearchIndex = field(default=None, repr=False)
+    entities: breach_entities.EntityIndex = field(default=None, repr=False)
+
+
+@stage
+def prepare_dataset(df: pd.DataFrame, key: str = None, text_path: str = None) -> PreparedDataset:
+    """
+    This function cleans the dataframe returned by read_file(), sorts it by the date of submission and builds its
+    aggregate cube. Cleaning a row does not depend on any other row, so cleaning the whole dataframe once and then
+    selecting a timeframe gives the same rows as selecting the timeframe first and cleaning it afterwards, which is
+    what the analysis functions do when they are given the original dataframe. The descriptions are indexed for
+    search_dataset() and moved to a text store before cleaning, and the covered entities are resolved with
+    add_entities() once the whole dataframe is cleaned, since they depend on every breach. The cleaned dataframe is then
+    compacted with compact_frame().
+
+    :param df: The original, unprocessed dataframe.
+    :param key: The key of the source file, if it is known.
+    :param text_path: The file to keep the descriptions in, relative to this script. By default, they are kept in
+    memory.
+    :return: The prepared dataset.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2009-01-02')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> dataset = prepare_dataset(df)
+    >>> dataset.data[['State', 'Breach Submission Date', 'Type of Breach', 'Location of Breach']]
+      State Breach Submission Date Type of Breach Location of Breach
+    1    NY             2009-01-02          Theft            Laptops
+    0    CA             2012-02-15           Loss             E-mail
+    """
+    texts = index = None
+    if 'Web Description' in df.columns:
+        index = breach_search.build_index(df['Web Description'])
+        df, texts = store_descriptions(df, text_path)
+
+    df = cleanup(df).sort_values('Breach Submission Date', kind='mergesort')
+    entities = None
+    if 'Name of Covered Entity' in df.columns:
+        entities = breach_entities.build_entity_index(df['Name of Covered Entity'], df['State'])
+    df = compact_frame(add_entities(df, entities))
+    if texts is not None:
+        texts.bounds = texts.bounds.loc[df.index]
+        index = breach_search.select_rows(index, df.index)
+
+    return PreparedDataset(df, key, build_cube(df), texts=texts, search_index=index, entities=entities)
+
+
+def dataset_key(path: str) -> str:
+    """
+    Builds the key that a cleaned dataset is cached under. It combines a hash of the contents of the source file with
+    a hash of the cleaning rules, so the cache is rebuilt when either of them changes.
+
+    :param path: The path of the source file in the user's system.
+    :return: The key.
+    """
+    content = hashlib.sha256()
+    with open(_full_path(path), 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            content.update(block)
+
+    return '{}-{}'.format(content.hexdigest()[:16], _rules_digest())
+
+
+def _rules_digest() -> str:
+    """
+    Returns a short hash of the cleaning rules, CLEANUP_VERSION and CUBE_DIMENSIONS, which changes whenever the way the
+    data is cleaned or aggregated does.
+
+    :return: The hash.
+    """
+    rules = hashlib.sha256(repr((CLEANUP_VERSION, sorted(COLUMN_RULES.items()), CUBE_DIMENSIONS)).encode('utf-8'))
+    return rules.hexdigest()[:8]
+
+
+@stage
+def load_dataset(path: str, cache_dir: str = CACHE_DIR) -> PreparedDataset:
+    """
+    Reads and prepares the dataset, going through an on-disk cache. If the source file and the cleaning rules have not
+    changed since the last run, the cleaned dataframe and its aggregate cube are loaded from the cache and the file is
+    not parsed or cleaned at all. Otherwise, the file is read with read_file(), prepared with prepare_dataset() and the
+    result replaces any older cached copy of the same file. The descriptions are kept in a text file in the cache, and
+    are only read from it when they are asked for. Their search index is cached along with them.
+
+    :param path: The path of the file in the user's system.
+    :param cache_dir: The folder the cleaned datasets are kept in, relative to this script. None disables the cache.
+    :return: The prepared dataset.
+    """
+    key = dataset_key(path)
+    if cache_dir is None:
+        return prepare_dataset(read_file(path), key)
+
+    folder = _full_path(cache_dir)
+    name = os.path.basename(path)
+    cache_file = os.path.join(folder, '{}.{}.pkl'.format(name, key))
+    cube_file = os.path.join(folder, '{}.{}.cube.pkl'.format(name, key))
+    bounds_file = os.path.join(folder, '{}.{}.text.pkl'.format(name, key))
+    index_file = os.path.join(folder, '{}.{}.index.pkl'.format(name, key))
+    text_path = os.path.join(cache_dir, '{}.{}.text'.format(name, key))
+
+    if os.path.exists(cache_file) and os.path.exists(bounds_file):
+        dataset = PreparedDataset(pd.read_pickle(cache_file), key,
+                                  texts=TextStore(text_path, pd.read_pickle(bounds_file)))
+        if os.path.exists(cube_file):
+            dataset.cube = load_cube(cube_file)
+        else:
+            save_cube(_dataset_cube(dataset), cube_file)
+        if os.path.exists(index_file):
+            dataset.search_index = pd.read_pickle(index_file)
+        else:
+            pd.to_pickle(_dataset_index(dataset), index_file)
+        return dataset
+
+    os.makedirs(folder, exist_ok=True)
+    for stale in glob.glob(os.path.join(folder, glob.escape(name) + '.*.pkl')) + \
+            glob.glob(os.path.join(folder, glob.escape(name) + '.*.text')):
+        os.remove(stale)
+
+    dataset = prepare_dataset(read_file(path), key, text_path)
+
+    dataset.data.to_pickle(cache_file)
+    dataset.texts.bounds.to_pickle(bounds_file)
+    pd.to_pickle(dataset.search_index, index_file)
+    save_cube(dataset.cube, cube_file)
+
+    return dataset
+
+
+@stage
+def update_dataset(path: str, cache_dir: str = CACHE_DIR) -> PreparedDataset:
+    """
+    This function keeps a cleaned copy of a breach report that is only ever added to, and brings it up to date by
+    reading just the rows that were added since the last time it was called. It remembers how many bytes of the file
+    it has read (the watermark) and a hash of them, and only parses, cleans and aggregates the rows after that point.
+    The new rows are sorted on their own and merged into the sorted data, the aggregate cube is updated with them
+    instead of being rebuilt, and their descriptions are added to the end of the text file and to the search index. The
+    names of the new breaches are resolved against the entity index with breach_entities.update_entities(), which gives
+    the same entities as building the dataset from the whole file without comparing the names that were already there.
+
+    A new row with the same ROW_KEY as a row read in an earlier call is an amended version of that breach and replaces
+    it. Rows read in the same call never replace each other, so until a breach is amended, the dataset has the same
+    rows as the one load_dataset() builds from the whole file. If the file was changed anywhere before the watermark,
+    or the cleaning rules have changed, the dataset is built again from the whole file, like load_dataset() does, and
+    the amended rows are kept along with their amendments. The state is kept in an 'incremental' folder of the cache,
+    apart from the datasets of load_dataset().
+
+    :param path: The path of the file in the user's system.
+    :param cache_dir: The folder the dataset is kept in, relative to this script.
+    :return: The prepared dataset, up to date with the file. Its key is made of the hash of the file, the number of
+    times the dataset was built again from the whole file and the hash of the cleaning rules.
+
+    >>> import shutil, tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> path = os.path.join(folder, 'report.csv')
+    >>> report = pd.read_csv(_full_path('breach_report.csv'), **CSV_OPTIONS)
+    >>> report.iloc[:1200].to_csv(path, index=False, encoding='latin1')
+    >>> first = update_dataset(path, os.path.join(folder, 'cache'))
+    >>> report.iloc[1200:].to_csv(path, mode='a', header=False, index=False, encoding='latin1')
+    >>> dataset = update_dataset(path, os.path.join(folder, 'cache'))
+    >>> whole = load_dataset(path, cache_dir=None)
+    >>> len(first.data), dataset.data.equals(whole.data), dataset.cube.equals(whole.cube)
+    (1110, True, True)
+    >>> shipped = update_dataset('breach_report.csv', os.path.join(folder, 'shipped'))
+    >>> shipped.data.equals(load_dataset('breach_report.csv', cache_dir=None).data), len(shipped.data)
+    (True, 1251)
+    >>> report.iloc[[3]].assign(**{'Individuals Affected': 12345.0}).to_csv(path, mode='a', header=False, index=False, encoding='latin1')
+    >>> dataset = update_dataset(path, os.path.join(folder, 'cache'))
+    >>> len(dataset.data), 3 in dataset.data.index, (dataset.data['Individuals Affected'] == 12345).sum()
+    (1251, False, 1)
+    >>> with open(path, 'r+b') as file:
+    ...     _ = file.seek(200)
+    ...     _ = file.write(b'X')
+    >>> update_dataset(path, os.path.join(folder, 'cache')).key != dataset.key
+    True
+    >>> shutil.rmtree(folder)
+    """
+    final_path = _full_path(path)
+    folder = os.path.join(_full_path(cache_dir), 'incremental')
+    state_file = os.path.join(folder, '{}.pkl'.format(os.path.basename(path)))
+    text_path = os.path.join(cache_dir, 'incremental', '{}.text'.format(os.path.basename(path)))
+    size = os.path.getsize(final_path)
+
+    state = pd.read_pickle(state_file) if os.path.exists(state_file) else None
+
+    # The part of the file that was already read and the whole file are hashed in a single pass.
+    prefix, digest = _prefix_digests(final_path, [0 if state is None else min(state['offset'], size), size])
+
+    if state is None or state['rules'] != _rules_digest() or not _watermark_matches(final_path, state, prefix):
+        df = read_file(path)
+        keys = _row_keys(df)
+        os.makedirs(folder, exist_ok=True)
+        dataset = prepare_dataset(df, text_path=text_path)
+        state = {'rules': _rules_digest(), 'columns': list(df.columns), 'date_format': df.attrs['date_format'],
+                 'rows': len(df), 'rebuilds': 0 if state is None else state.get('rebuilds', 0) + 1,
+                 'data': dataset.data, 'cube': dataset.cube, 'row_keys': keys.loc[dataset.data.index],
+                 'text_bounds': dataset.texts.bounds, 'search_index': dataset.search_index,
+                 'entities': dataset.entities}
+    elif size > state['offset']:
+        with open(final_path, 'rb') as file:
+            file.seek(state['offset'])
+            new = pd.read_csv(file, header=None, names=state['columns'], **CSV_OPTIONS)
+        new.index = pd.RangeIndex(state['rows'], state['rows'] + len(new))
+        new = _parse_submission_dates(new, state['date_format'])
+
+        # The breaches that the new rows amend are taken out, along with their share of the cube.
+        keys = _row_keys(new)
+        amended = state['row_keys'].isin(keys)
+        removed = state['data'].loc[state['row_keys'].index[amended]]
+
+        descriptions = new['Web Description']
+        new, texts = store_descriptions(new, store=TextStore(text_path, state['text_bounds']))
+        added = cleanup(new)
+        state['search_index'] = breach_search.update_index(state['search_index'], descriptions.loc[added.index],
+                                                           removed.index)
+
+        # The entities of the breaches already in the data only change if the new names merged or split them.
+        entities, ids = breach_entities.update_entities(state['entities'], added['Name of Covered Entity'],
+                                                        added['State'], removed['Name of Covered Entity'],
+                                                        removed['State'])
+        data = state['data'].drop(index=removed.index)
+        if ids is None:
+            data = add_entities(data, entities)
+        else:
+            ids = np.append(ids, -1)[data['Entity ID'].to_numpy()]
+            data = data.assign(**breach_entities.entity_columns(entities, ids, data.index))
+        state['data'] = compact_frame(_merge_rows(data, add_entities(added, entities)))
+        state['entities'] = entities
+        state['text_bounds'] = texts.bounds.loc[state['data'].index]
+        state['cube'] = _update_cube(state['cube'], added, removed)
+        state['row_keys'] = pd.concat([state['row_keys'][~amended], keys.loc[added.index]])
+        state['rows'] += len(keys)
+    else:
+        return PreparedDataset(state['data'], state['key'], state['cube'],
+                               texts=TextStore(text_path, state['text_bounds']), search_index=state['search_index'],
+                               entities=state['entities'])
+
+    state['offset'] = size
+    state['digest'] = digest
+    state['key'] = '{}-{}-{}'.format(digest[:16], state['rebuilds'], state['rules'])
+
+    os.makedirs(folder, exist_ok=True)
+    pd.to_pickle(state, state_file)
+
+    return PreparedDataset(state['data'], state['key'], state['cube'], texts=TextStore(text_path, state['text_bounds']),
+                           search_index=state['search_index'], entities=state['entities'])
+
+
+def _watermark_matches(path: str, state: dict, digest: str) -> bool:
+    """
+    Checks that the part of the file update_dataset() has already read is still there: the file is at least as long as
+    it was, none of the bytes before the watermark have changed, and the watermark is at the end of a line.
+
+    :param path: The full path of the file.
+    :param state: The state saved by update_dataset().
+    :param digest: The hash of the bytes of the file before the watermark, from _prefix_digests().
+    :return: True if only new rows can have been added to the file.
+    """
+    offset = state['offset']
+    if os.path.getsize(path) < offset or digest != state['digest']:
+        return False
+
+    with open(path, 'rb') as file:
+        file.seek(max(offset - 1, 0))
+        return offset == 0 or file.read(1) == b'\n'
+
+
+def _prefix_digests(path: str, offsets: list) -> list:
+    """
+    Hashes the bytes of a file before each of the offsets, reading the file only once.
+
+    :param path: The full path of the file.
+    :param offsets: The offsets, in increasing order.
+    :return: The hash of the bytes before each offset.
+    """
+    content, digests = hashlib.sha256(), []
+    with open(path, 'rb') as file:
+        for offset in offsets:
+            while file.tell() < offset:
+                block = file.read(min(1 << 20, offset - file.tell()))
+                if not block:
+                    break
+                content.update(block)
+            digests.append(content.hexdigest())
+
+    return digests
+
+
+def _merge_rows(data: pd.DataFrame, added: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges new rows into the data, which is sorted by date, without sorting it again. Only the new rows are sorted, and
+    each of them is inserted after the rows of the same date, which is where a stable sort of all the rows would put
+    it. The categoricals of the data are kept, with the categories of both.
+
+    :param data: The compacted data, sorted by date.
+    :param added: The new cleaned rows.
+    :return: The merged data.
+    """
+    added = added.sort_values('Breach Submission Date', kind='mergesort')
+    positions = data['Breach Submission Date'].to_numpy().searchsorted(added['Breach Submission Date'].to_numpy(),
+                                                                       side='right')
+    order = np.insert(np.arange(len(data)), positions, np.arange(len(data), len(data) + len(added)))
+
+    columns = {}
+    for column in data.columns:
+        if isinstance(data[column].dtype, pd.CategoricalDtype):
+            values = union_categoricals([data[column].array, pd.Categorical(added[column])], sort_categories=True)
+            columns[column] = values.take(order).remove_unused_categories()
+        else:
+            columns[column] = pd.concat([data[column], added[column]], ignore_index=True).take(order).to_numpy()
+
+    return pd.DataFrame(columns, index=data.index.append(added.index).take(order))
+
+
+def _row_keys(df: pd.DataFrame) -> pd.Series:
+    """
+    Hashes the ROW_KEY columns of every row, so that rows of the same breach can be matched quickly.
+
+    :param df: The dataframe.
+    :return: The hash of every row, with the same index as the dataframe.
+    """
+    return pd.util.hash_pandas_object(df[ROW_KEY], index=False)
+
+
+def _update_cube(cube: pd.DataFrame, added: pd.DataFrame, removed: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the breaches in one dataframe to the cube, and takes the ones in another out of it. Only the new and removed
+    rows are aggregated; the result is the same as building the cube again from the updated data.
+
+    :param cube: The cube built by build_cube().
+    :param added: The cleaned breaches to add.
+    :param removed: The cleaned breaches to take out.
+    :return: The updated cube.
+    """
+    removed = build_cube(removed)
+    measures = [column for column in removed.columns if column not in CUBE_DIMENSIONS]
+    removed[measures] = -removed[measures]
+
+    cube = pd.concat([cube, build_cube(added), removed])
+    cube = cube.groupby(CUBE_DIMENSIONS, dropna=False).sum().reset_index()
+
+    return cube.loc[cube['Breaches'] != 0].reset_index(drop=True)
+
+
+@stage
+def select_dates(dataset: PreparedDataset, end: str = '2013-09-22', start: str = '2009-01-01') -> pd.DataFrame:
+    """
+    This function does the same thing as adjust_time_limits(), with the same inclusive limits, for a prepared dataset.
+    Since the data is sorted by date, the first and last rows in the timeframe are found with a binary search instead
+    of comparing every date, and the rows between them are returned as a slice of the data without copying it.
+
+    :param dataset: The prepared dataset.
+    :param end: The desired end date.
+    :param start: The desired start date.
+    :return: The dataframe with records between the desired date limits.
+
+    >>> df = pd.DataFrame([[1, pd.Timestamp('2008-12-31')], [2, pd.Timestamp('2010-07-15')], [3, pd.Timestamp('2012-12-31')]], columns=["A", "Breach Submission Date"])
+    >>> select_dates(PreparedDataset(df), '2012-12-31')
+       A Breach Submission Date
+    1  2             2010-07-15
+    2  3             2012-12-31
+    >>> select_dates(PreparedDataset(df), '2009-01-01', '2012-12-31')
+    Empty DataFrame
+    Columns: [A, Breach Submission Date]
+    Index: []
+    """
+    left, right = _date_bounds(dataset.data['Breach Submission Date'], [start], [end])
+    return dataset.data.iloc[left[0]:right[0]]
+
+
+def select_windows(dataset: PreparedDataset, windows: list) -> list:
+    """
+    Selects the records of many timeframes at once. The limits of all the timeframes are found with a single
+    vectorized binary search, and each timeframe is returned as a slice of the data, like select_dates() does.
+
+    :param dataset: The prepared dataset.
+    :param windows: A list of (start, end) date pairs. Both limits are inclusive.
+    :return: A list with the dataframe of each timeframe, in the same order as the windows.
+
+    >>> df = pd.DataFrame([[1, pd.Timestamp('2008-12-31')], [2, pd.Timestamp('2010-07-15')], [3, pd.Timestamp('2012-12-31')]], columns=["A", "Breach Submission Date"])
+    >>> [window['A'].tolist() for window in select_windows(PreparedDataset(df), [('2009-01-01', '2012-12-31'), ('2008-12-31', '2008-12-31'), ('2013-01-01', '2013-12-31')])]
+    [[2, 3], [1], []]
+    """
+    dates = dataset.data['Breach Submission Date']
+    left, right = _date_bounds(dates, [start for start, end in windows], [end for start, end in windows])
+    return [dataset.data.iloc[i:j] for i, j in zip(left, right)]
+
+
+@stage
+def aggregate_windows(dataset: PreparedDataset, windows: list) -> pd.DataFrame:
+    """
+    Counts the breaches and sums up the columns in AGGREGATE_SUMS in many timeframes at once, with the start and end of
+    every timeframe as columns rather than as the index. The sums come from sweep_windows(), so every timeframe only
+    costs a subtraction of the running totals of daily_sums(), however many rows it has.
+
+    :param dataset: The prepared dataset.
+    :param windows: A list of (start, end) date pairs. Both limits are inclusive.
+    :return: A dataframe with one row for each timeframe.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-03-02')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> windows = aggregate_windows(prepare_dataset(df), [('2012-01-01', '2012-12-31'), ('2012-03-01', '2012-03-31')])
+    >>> windows[['Start', 'End', 'Breaches', 'Individuals Affected']]
+           Start        End  Breaches  Individuals Affected
+    0 2012-01-01 2012-12-31         2                  20.0
+    1 2012-03-01 2012-03-31         1                   7.0
+    """
+    return sweep_windows(dataset, windows).reset_index()
+
+
+def _date_bounds(dates: pd.Series, starts: list, ends: list) -> tuple:
+    """
+    Finds the positions of the first row on or after each start date, and of the first row after each end date, in a
+    sorted column of dates. The missing dates are at the end of the column, and are never inside a timeframe.
+
+    :param dates: The sorted dates.
+    :param starts: The start dates.
+    :param ends: The end dates.
+    :return: The arrays of the first and last (excluded) positions.
+    """
+    dates = dates.to_numpy()
+    left = dates.searchsorted(pd.to_datetime(starts).to_numpy(), side='left')
+    right = dates.searchsorted(pd.to_datetime(ends).to_numpy(), side='right')
+
+    # A start date after the end date selects nothing.
+    return left, np.maximum(left, right)
+
+
+@stage
+def daily_sums(dataset: PreparedDataset, by: str = None) -> pd.DataFrame:
+    """
+    This function builds the running totals of the number of breaches and of the columns in AGGREGATE_SUMS for every
+    day from the first to the last date of submission, optionally for each value of a column. Days without any breach
+    are included, so the totals up to a date are always the same number of rows after the first one, and
+    sweep_windows(), rolling_trend() and seasonal_index() find them without a binary search. The totals are kept in the
+    dataset, so they are only built once.
+
+    :param dataset: The prepared dataset.
+    :param by: The column to keep separate totals for, one of the columns of the data in CUBE_DIMENSIONS. Every day gets
+    a column for each of its values, so columns with many values, like the names of the covered entities, can't be
+    used. By default, all the breaches are added up together.
+    :return: The running totals, indexed by day, starting with a row of zeros on the day before the first breach. With
+    'by', the columns are the pairs of a measure and a value of the column.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-02-17')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> dataset = prepare_dataset(df)
+    >>> daily_sums(dataset)[['Breaches', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+                Breaches  Individuals Affected
+    Date
+    2012-02-14         0                   0.0
+    2012-02-15         1                  13.0
+    2012-02-16         1                  13.0
+    2012-02-17         2                  20.0
+    >>> daily_sums(dataset, 'Type of Breach')['Breaches']  # doctest: +NORMALIZE_WHITESPACE
+    Type of Breach  Loss  Theft
+    Date
+    2012-02-14         0      0
+    2012-02-15         1      0
+    2012-02-16         1      0
+    2012-02-17         1      1
+    """
+    if by in dataset.daily_sums:
+        return dataset.daily_sums[by]
+    if by is not None and (by not in CUBE_DIMENSIONS or by not in dataset.data.columns):
+        raise ValueError("The running totals can't be split by {!r}, only by one of the columns of the data in "
+                         "CUBE_DIMENSIONS.".format(by))
+
+    source = dataset.data.assign(Breaches=1)
+    source = source.loc[source['Breach Submission Date'].notna()]
+    measures = ['Breaches'] + [column for column in source.columns if column in AGGREGATE_SUMS]
+
+    columns = ['Breach Submission Date'] + ([] if by is None else [by])
+    daily = _widen_sums(source.groupby(_group_keys(source, columns))[measures].sum())
+    if by is not None:
+        daily = daily.unstack(by, fill_value=0)
+
+    # Without any dated breach, the totals are just two rows of zeros.
+    first = daily.index.min() if len(daily) else pd.Timestamp(0)
+    last = daily.index.max() if len(daily) else first
+    days = pd.date_range(first - pd.Timedelta(days=1), last, freq='D', name='Date')
+
+    dataset.daily_sums[by] = daily.reindex(days, fill_value=0).cumsum()
+    return dataset.daily_sums[by]
+
+
+@stage
+def sweep_windows(dataset: PreparedDataset, windows: list, by: str = None) -> pd.DataFrame:
+    """
+    This function adds up the breaches in any number of timeframes, optionally for each value of a column. Each
+    timeframe is the difference between the running totals of daily_sums() on its last day and on the day before it
+    starts, which are found by counting days from the first row, so it costs the same however long it is.
+
+    :param dataset: The prepared dataset.
+    :param windows: A list of (start, end) date pairs. Both limits are inclusive.
+    :param by: The column to add up the breaches separately for (see daily_sums()).
+    :return: The number of breaches and the sums of the other measures in every timeframe, indexed by its start and
+    end dates.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2011-12-20')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-03-02')], ['NY', 'Health Plan', 'No', 4, 'Theft', 'Paper', 'Records stolen', pd.Timestamp('2012-12-01')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> holidays = [('2011-11-15', '2011-12-31'), ('2012-11-15', '2012-12-31'), ('2012-01-01', '2012-11-14')]
+    >>> sweep_windows(prepare_dataset(df), holidays)[['Breaches', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+                           Breaches  Individuals Affected
+    Start      End
+    2011-11-15 2011-12-31         1                  13.0
+    2012-11-15 2012-12-31         1                   4.0
+    2012-01-01 2012-11-14         1                   7.0
+    """
+    starts = pd.to_datetime([start for start, end in windows]).normalize()
+    ends = pd.to_datetime([end for start, end in windows]).normalize()
+
+    sums = daily_sums(dataset, by)
+    right = _day_positions(sums, ends)
+    # A start date after the end date adds up nothing.
+    left = np.minimum(_day_positions(sums, starts - pd.Timedelta(days=1)), right)
+
+    totals = sums.to_numpy()
+    index = pd.MultiIndex.from_arrays([starts, ends], names=['Start', 'End'])
+    return pd.DataFrame(totals[right] - totals[left], index=index, columns=sums.columns).astype(sums.dtypes)
+
+
+@stage
+def year_over_year(dataset: PreparedDataset, windows: list, by: str = None) -> pd.DataFrame:
+    """
+    Compares every timeframe with the same timeframe a year earlier.
+
+    :param dataset: The prepared dataset.
+    :param windows: A list of (start, end) date pairs. Both limits are inclusive.
+    :param by: The column to compare the breaches separately for.
+    :return: The change in the number of breaches and the sums of the other measures, indexed like sweep_windows().
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2011-12-20')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-12-02')], ['NY', 'Health Plan', 'No', 4, 'Theft', 'Paper', 'Records stolen', pd.Timestamp('2012-12-01')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> year_over_year(prepare_dataset(df), [('2012-11-15', '2012-12-31')])[['Breaches', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+                           Breaches  Individuals Affected
+    Start      End
+    2012-11-15 2012-12-31         1                  -2.0
+    """
+    year = pd.DateOffset(years=1)
+    earlier = [(pd.Timestamp(start) - year, pd.Timestamp(end) - year) for start, end in windows]
+
+    current = sweep_windows(dataset, windows, by)
+    previous = sweep_windows(dataset, earlier, by)
+    previous.index = current.index
+    return current - previous
+
+
+@stage
+def rolling_trend(dataset: PreparedDataset, days: int = 30, by: str = None) -> pd.DataFrame:
+    """
+    This function adds up the breaches of the last few days on every day, from the running totals of daily_sums(). The
+    first days of the data have no breaches before them, so their totals only cover the days since the first breach.
+
+    :param dataset: The prepared dataset.
+    :param days: The number of days to add up, including the day itself.
+    :param by: The column to add up the breaches separately for (see daily_sums()).
+    :return: The number of breaches and the sums of the other measures in the days up to every date, indexed by date.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-02-17')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> rolling_trend(prepare_dataset(df), 2)[['Breaches', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+                Breaches  Individuals Affected
+    Date
+    2012-02-15         1                  13.0
+    2012-02-16         1                  13.0
+    2012-02-17         1                   7.0
+    """
+    sums = daily_sums(dataset, by)
+    totals = sums.to_numpy()
+    before = np.maximum(np.arange(1, len(sums)) - days, 0)
+
+    trend = pd.DataFrame(totals[1:] - totals[before], index=sums.index[1:], columns=sums.columns)
+    return trend.astype(sums.dtypes)
+
+
+@stage
+def seasonal_index(dataset: PreparedDataset, end: str = '2013-09-22', start: str = '2009-01-01',
+                   by: str = None) -> pd.DataFrame:
+    """
+    This function divides the totals of every month in the timeframe by those of the average month of the same year,
+    so that years with very different numbers of breaches can be compared: a month with an index of 1.0 is an ordinary
+    month of its year. Averaging the index of every month over the years gives the seasonal pattern. The months are
+    added up with sweep_windows(), and the ones without any breach are included. The average of a year only covers its
+    months in the timeframe.
+
+    :param dataset: The prepared dataset.
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :param by: The column to work out the index separately for.
+    :return: The index of the number of breaches and the other measures, indexed by year and month like
+    monthly_table().
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-01-20')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-03-02')], ['NY', 'Health Plan', 'No', 4, 'Theft', 'Paper', 'Records stolen', pd.Timestamp('2012-03-05')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> seasonal_index(prepare_dataset(df), '2012-04-30', '2012-01-01')[['Breaches', 'Individuals Affected']].round(2)  # doctest: +NORMALIZE_WHITESPACE
+                Breaches  Individuals Affected
+    Year Month
+    2012 1          1.33                  2.17
+         2          0.00                  0.00
+         3          2.67                  1.83
+         4          0.00                  0.00
+    """
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+    months = pd.date_range(start.to_period('M').start_time, end, freq='MS')
+    windows = [(max(month, start), min(month + pd.offsets.MonthEnd(1), end)) for month in months]
+
+    totals = sweep_windows(dataset, windows, by).astype('float64')
+    totals.index = pd.MultiIndex.from_arrays([months.year, months.month], names=['Year', 'Month'])
+
+    return totals / totals.groupby(level='Year').transform('mean')
+
+
+def _day_positions(sums: pd.DataFrame, dates: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Finds the rows of the running totals built by daily_sums() on each date. Dates before the first row or after the
+    last one get the first or the last row, since no breach happened outside of them.
+
+    :param sums: The running totals, one row for every day.
+    :param dates: The dates.
+    :return: The positions of the rows.
+    """
+    days = (dates - sums.index[0]).days.to_numpy()
+    return np.clip(days, 0, len(sums) - 1)
+
+
+def _clean_window(df: Union[pd.DataFrame, PreparedDataset], end: str, start: str) -> pd.DataFrame:
+    """
+    Returns the cleaned breaches between the two dates. A prepared dataset only has to be sliced with select_dates(),
+    while the original dataframe is sliced with adjust_time_limits() and then cleaned with cleanup(). The result may be
+    a view of the prepared data, so it should not be changed in place.
+
+    :param df: The original dataframe or the prepared dataset.
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :return: The cleaned dataframe with records between the desired date limits.
+    """
+    if isinstance(df, PreparedDataset):
+        return select_dates(df, end, start)
+
+    df = adjust_time_limits(df, end, start)
+    return cleanup(df)
+
+
+@stage
+def aggregate_tables(df: Union[pd.DataFrame, PreparedDataset]) -> dict:
+    """
+    This function aggregates the cleaned data by each of the dimensions in AGGREGATE_DIMENSIONS (the type, location,
+    state, and the year and month of the breach). Every table has the number of breaches and the sums of the columns in
+    AGGREGATE_SUMS. stream_aggregates() builds the same tables without loading the whole file into memory.
+
+    :param df: The cleaned dataframe, or the prepared dataset.
+    :return: A dictionary of the aggregate tables, keyed by the name of the dimension.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-02-02')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> tables = aggregate_tables(prepare_dataset(df))
+    >>> tables['Type of Breach'][['Breaches', 'Individuals Affected', 'Business Associate Present']]  # doctest: +NORMALIZE_WHITESPACE
+                    Breaches  Individuals Affected  Business Associate Present
+    Type of Breach
+    Loss                   1                  13.0                           1
+    Theft                  1                   7.0                           0
+    >>> tables['Month'][['Breaches', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+                Breaches  Individuals Affected
+    Year Month
+    2012 2             2                  20.0
+    """
+    if isinstance(df, PreparedDataset):
+        df = df.data
+
+    return {name: _aggregate(df, columns) for name, columns in AGGREGATE_DIMENSIONS.items()}
+
+
+@stage
+def stream_aggregates(path: str, chunksize: int = 100000) -> dict:
+    """
+    This function builds the same tables as aggregate_tables(), but reads the file a chunk at a time. Each chunk is
+    cleaned, aggregated and folded into the running totals before the next one is read, so the memory used depends on
+    the size of the chunks and the number of groups, and not on the size of the file.
+
+    :param path: The path of the file in the user's system.
+    :param chunksize: The number of rows read at a time.
+    :return: A dictionary of the aggregate tables, keyed by the name of the dimension.
+
+    >>> streamed = stream_aggregates('breach_report.csv', chunksize=333)
+    >>> loaded = aggregate_tables(cleanup(read_file('breach_report.csv')))
+    >>> all(streamed[name].equals(loaded[name]) for name in AGGREGATE_DIMENSIONS)
+    True
+    """
+    totals = {}
+    for chunk in read_file(path, chunksize):
+        chunk = cleanup(chunk)
+        for name, columns in AGGREGATE_DIMENSIONS.items():
+            table = _aggregate(chunk, columns)
+            if name in totals:
+                table = pd.concat([totals[name], table]).groupby(level=columns).sum()
+            totals[name] = table
+
+    return totals
+
+
+@stage
+def _aggregate(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    Counts the breaches and sums up the columns in AGGREGATE_SUMS for every group of the given columns. The 'Year' and
+    'Month' columns are taken from the date of submission, leaving out the breaches without a date.
+
+    :param df: The cleaned dataframe.
+    :param columns: The columns to group by.
+    :return: The aggregate table.
+    """
+    if 'Year' in columns or 'Month' in columns:
+        df = df.loc[df['Breach Submission Date'].notna()]
+        df = df.assign(Year=df['Breach Submission Date'].dt.year.astype('int64'),
+                       Month=df['Breach Submission Date'].dt.month.astype('int64'))
+
+    grouped = df.groupby(_group_keys(df, columns))
+    table = _widen_sums(grouped[AGGREGATE_SUMS].sum())
+    table.insert(0, 'Breaches', grouped.size())
+
+    return table.astype({'Breaches': 'int64'})
+
+
+def _group_keys(df: pd.DataFrame, columns: list) -> list:
+    """
+    Returns the columns to group a dataframe by, with plain copies of the categorical ones. pandas groups categoricals
+    by all of their categories, in the order of the categories, and leaves out their missing values even with
+    dropna=False, so the groups would not be the same as those of the strings compact_frame() turned into categoricals.
+
+    :param df: The dataframe.
+    :param columns: The names of the columns to group by.
+    :return: The columns.
+    """
+    return [df[column].astype(object) if isinstance(df[column].dtype, pd.CategoricalDtype) else df[column]
+            for column in columns]
+
+
+def _widen_sums(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Gives the sums of a grouped dataframe the same types however the data was stored: 'Individuals Affected' is a float,
+    as read_csv() reads it, even if compact_frame() narrowed it to an integer, and the binary columns are int64 rather
+    than int8.
+
+    :param table: The sums of each group.
+    :return: The sums, with the widened types.
+    """
+    types = {'Individuals Affected': 'float64', 'Business Associate Present': 'int64',
+             'Covered Entities Involved': 'int64', 'Breaches': 'int64'}
+    return table.astype({column: dtype for column, dtype in types.items() if column in table.columns})
+
+
+@stage
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function builds the aggregate cube of the cleaned data: the number of breaches and the sums of the columns in
+    AGGREGATE_SUMS for every combination of year, month, state, type and location of breach that occurs in the data.
+    Every aggregation the analysis functions do can be answered by adding up rows of the cube and the few rows in the
+    months a timeframe only partly covers (see rollup_cube()). Since it is grouped by month rather than by day, the
+    cube only grows with the number of months and of distinct combinations, not with the number of breaches. It is
+    sorted by year and month so that the months of a timeframe can be found by a binary search. Breaches without a
+    date of submission are never in a timeframe, so they are left out.
+
+    :param df: The cleaned dataframe.
+    :return: The cube, with one row for each combination of CUBE_DIMENSIONS.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['CA', 'Health Plan', 'No', 7, 'Loss', 'Email', 'Email lost', pd.Timestamp('2012-02-20')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-03-02')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> cube = prepare_dataset(df).cube
+    >>> cube[['Year', 'Month', 'State', 'Type of Breach', 'Breaches', 'Individuals Affected']]
+       Year  Month State Type of Breach  Breaches  Individuals Affected
+    0  2012      2    CA           Loss         2                  20.0
+    1  2012      3    NY          Theft         1                   7.0
+    """
+    df = df.loc[df['Breach Submission Date'].notna()]
+    dates = pd.DatetimeIndex(df['Breach Submission Date'])
+    df = df.assign(Year=dates.year.astype('int64'), Month=dates.month.astype('int64'))
+    measures = [column for column in df.columns if column in AGGREGATE_SUMS]
+
+    grouped = df.groupby(_group_keys(df, CUBE_DIMENSIONS), dropna=False)
+    cube = _widen_sums(grouped[measures].sum())
+    cube.insert(0, 'Breaches', grouped.size())
+
+    cube = cube.reset_index().sort_values(['Year', 'Month'], kind='mergesort')
+    return cube.reset_index(drop=True)
+
+
+@stage
+def rollup_cube(cube: pd.DataFrame, columns: list, end: str = '2013-09-22', start: str = '2009-01-01',
+                data: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    This function adds up the rows of the cube in a timeframe by the desired columns, which gives the same numbers as
+    grouping the cleaned data in that timeframe by those columns. The months the timeframe covers completely are taken
+    from the cube, and the breaches in the months at its start and end that it only covers partly are taken from the
+    sorted data, so only those few rows are aggregated again.
+
+    :param cube: The cube built by build_cube().
+    :param columns: The columns to group by, out of CUBE_DIMENSIONS.
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :param data: The cleaned data, sorted by date, that the cube was built from. It is only needed if the timeframe
+    doesn't start at the beginning of a month or doesn't end at the end of one.
+    :return: The number of breaches and the sums of the other measures for each group.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['CA', 'Health Plan', 'No', 7, 'Theft', 'Email', 'Email stolen', pd.Timestamp('2012-02-20')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-03-02')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> dataset = prepare_dataset(df)
+    >>> rollup_cube(dataset.cube, ['Year', 'Month'], '2012-12-31', '2012-01-01')[['Breaches', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+                Breaches  Individuals Affected
+    Year Month
+    2012 2             2                  20.0
+         3             1                   7.0
+    >>> rollup_cube(dataset.cube, ['Type of Breach'], '2012-03-31', '2012-02-16', dataset.data)[['Breaches', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+                    Breaches  Individuals Affected
+    Type of Breach
+    Theft                  2                  14.0
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    first = start if start.is_month_start else start + pd.offsets.MonthBegin()
+    last = end if end.is_month_end else end - pd.offsets.MonthEnd()
+
+    # The full months are found by their number since year 0, which grows with the order of the cube.
+    months = cube['Year'].to_numpy() * 12 + cube['Month'].to_numpy() - 1
+    if first <= last:
+        left = months.searchsorted(first.year * 12 + first.month - 1, side='left')
+        right = months.searchsorted(last.year * 12 + last.month - 1, side='right')
+        window = cube.iloc[left:right]
+        edges = [(start, first - pd.Timedelta(days=1)), (last + pd.Timedelta(days=1), end)]
+    else:
+        window = cube.iloc[0:0]
+        edges = [(start, end)]
+    edges = [(edge_start, edge_end) for edge_start, edge_end in edges if edge_start <= edge_end]
+
+    if edges:
+        if data is None:
+            raise ValueError('The timeframe covers part of a month, so the data of the cube is needed as well.')
+        starts, ends = _date_bounds(data['Breach Submission Date'], [edge[0] for edge in edges],
+                                    [edge[1] for edge in edges])
+        partial = pd.concat([data.iloc[i:j] for i, j in zip(starts, ends)])
+        window = pd.concat([window, build_cube(partial)], ignore_index=True)
+
+    measures = [column for column in window.columns if column not in CUBE_DIMENSIONS]
+    return window.groupby(columns)[measures].sum()
+
+
+def save_cube(cube: pd.DataFrame, path: str) -> None:
+    """
+    Saves the cube to a file, so that it can be loaded again with load_cube() without the data it was built from.
+
+    :param cube: The cube built by build_cube().
+    :param path: The path of the file, relative to this script.
+    :return: No return value.
+    """
+    cube.to_pickle(_full_path(path))
+
+
+def load_cube(path: str) -> pd.DataFrame:
+    """
+    Loads a cube that was saved with save_cube().
+
+    :param path: The path of the file, relative to this script.
+    :return: The cube.
+    """
+    return pd.read_pickle(_full_path(path))
+
+
+def _dataset_cube(dataset: PreparedDataset) -> pd.DataFrame:
+    """
+    Returns the cube of the prepared dataset, building it first if the dataset doesn't have one yet.
+
+    :param dataset: The prepared dataset.
+    :return: The cube.
+    """
+    if dataset.cube is None:
+        dataset.cube = build_cube(dataset.data)
+    return dataset.cube
+
+
+@stage
+def aggregate_dataset(dataset: PreparedDataset, columns: list, end: str = '2013-09-22',
+                      start: str = '2009-01-01') -> pd.DataFrame:
+    """
+    This function counts the breaches and sums up the columns in AGGREGATE_SUMS for every group of the given columns in
+    a timeframe. If all the columns are in CUBE_DIMENSIONS, the table is rolled up from the cube with rollup_cube(), and
+    otherwise the rows in the timeframe are grouped, which gives the same numbers.
+
+    :param dataset: The prepared dataset.
+    :param columns: The columns to group by. 'Year' and 'Month' are taken from the date of submission.
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :return: The number of breaches and the sums of the other measures for each group.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['CA', 'Health Plan', 'No', 7, 'Theft', 'Email', 'Email stolen', pd.Timestamp('2012-02-20')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-03-02')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> dataset = prepare_dataset(df)
+    >>> aggregate_dataset(dataset, ['State'], '2012-12-31', '2012-02-16')[['Breaches', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+           Breaches  Individuals Affected
+    State
+    CA            1                   7.0
+    NY            1                   7.0
+    >>> aggregate_dataset(dataset, ['Business Associate Present'], '2012-12-31', '2012-02-16')[['Breaches']]  # doctest: +NORMALIZE_WHITESPACE
+                                Breaches
+    Business Associate Present
+    0                                  2
+    """
+    if all(column in CUBE_DIMENSIONS for column in columns):
+        return rollup_cube(_dataset_cube(dataset), columns, end, start, dataset.data)
+    return _aggregate(select_dates(dataset, end, start), columns)
+
+
+@stage
+def search_dataset(dataset: PreparedDataset, query: str) -> PreparedDataset:
+    """
+    This function keeps only the breaches whose descriptions match a query, such as '"unencrypted laptop"' or
+    'phishing OR ransomware' (see breach_search.search() for the syntax). The matching rows are found in the search
+    index instead of going through every description, and the result is a prepared dataset of its own, so it can be
+    passed to any of the analysis functions in place of the whole dataset.
+
+    :param dataset: The prepared dataset.
+    :param query: The query.
+    :return: The prepared dataset of the matching breaches.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Unencrypted e-mail sent', pd.Timestamp('2012-02-15')], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2012-03-02')], ['TX', 'Health Plan', 'No', 5, 'Theft', 'Laptop', 'Encrypted laptop stolen', pd.Timestamp('2012-03-05')]], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> dataset = search_dataset(prepare_dataset(df), 'laptop AND NOT encrypted')
+    >>> dataset.data[['State', 'Type of Breach']]
+      State Type of Breach
+    1    NY          Theft
+    >>> read_descriptions(search_dataset(prepare_dataset(df), 'encrypted OR unencrypted').texts).tolist()
+    ['Unencrypted e-mail sent', 'Encrypted laptop stolen']
+    """
+    index = _dataset_index(dataset)
+    if index is None:
+        print("The dataset doesn't have any descriptions to search. Returning the unchanged dataset.")
+        return dataset
+
+    rows = breach_search.search(index, query)
+    data = dataset.data.loc[dataset.data.index.isin(rows)]
+
+    texts = None if dataset.texts is None else TextStore(dataset.texts.path, dataset.texts.bounds.loc[data.index],
+                                                         dataset.texts.buffer)
+    key = None if dataset.key is None else '{}?{}'.format(dataset.key, query)
+    return PreparedDataset(data, key, build_cube(data), texts=texts,
+                           search_index=breach_search.select_rows(index, data.index))
+
+
+def _dataset_index(dataset: PreparedDataset) -> breach_search.SearchIndex:
+    """
+    Returns the search index of the prepared dataset, building it from the descriptions first if the dataset doesn't
+    have one yet.
+
+    :param dataset: The prepared dataset.
+    :return: The search index, or None if the dataset has no descriptions.
+    """
+    if dataset.search_index is None and dataset.texts is not None:
+        dataset.search_index = breach_search.build_index(read_descriptions(dataset.texts))
+    return dataset.search_index
+
+
+@stage
+def column_tables(df: Union[pd.DataFrame, PreparedDataset], column_name: str, end: str = '2013-09-22',
+                  start: str = '2009-01-01') -> tuple:
+    """
+    This function does the aggregation for analyze_column(): the sums of the numeric columns for every value of the
+    desired column, and the percentage of each sum that each value contributes.
+
+    :param df: The dataframe containing the columns to be aggregated, or the prepared dataset from prepare_dataset().
+    :param column_name: The column by which the dataframe will be aggregated by.
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :return: The aggregated values and the percentage values.
+    """
+    if isinstance(df, PreparedDataset) and column_name in CUBE_DIMENSIONS:
+        agg = rollup_cube(_dataset_cube(df), [column_name], end, start, df.data).drop(columns=['Breaches'])
+    else:
+        df = _clean_window(df, end, start)
+        measures = [column for column in df.columns if column in AGGREGATE_SUMS]
+        agg = _widen_sums(df.groupby(_group_keys(df, [column_name]))[measures].sum())
+
+    # The binary columns are int8, so they are widened before being scaled to avoid overflowing.
+    percentage_values = round(agg.apply(lambda x: 100 * x.astype('float64') / float(x.sum())), 2)
+
+    return agg, percentage_values
+
+
+@stage
+def analyze_column(df: Union[pd.DataFrame, PreparedDataset], column_name: str, end: str = '2013-09-22',
+                   start: str = '2009-01-01', output: str = None) -> None:
     """
 
     This function performs the group_by() on the desired column and plots the aggregated values of individuals affected,
     'business associate present' and 'covered entities involved'.
+    When it is given a prepared dataset, the values are added up from its aggregate cube instead of the cleaned rows.
 
-    :param df: The dataframe containing the columns to be aggregated.
+    :param df: The dataframe containing the columns to be aggregated, or the prepared dataset from prepare_dataset().
     :param column_name: The column by which the dataframe will be aggregated by.
     :param end: The end date of the desired timeframe.
     :param start: The start date of the desired timeframe.
+    :param output: The file to save the plot to. If it is not given, the plot is shown instead.
     :return: Prints all the required information inside the function. No return value.
 
     >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email','2010-15-02'], ['NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen','2009-01-02']], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', "Breach Submission Date"])
@@ -307,43 +1799,167 @@ def analyze_column(df: pd.DataFrame, column_name: str, end: str = '2013-09-22',
 
     """
 
-    df = adjust_time_limits(df, end, start)
-
-    df = cleanup(df)
+    agg, percentage_values = column_tables(df, column_name, end, start)
 
     # pd.set_option('display.max_columns', 3)
     print("Aggregated values when grouped by {}:".format(column_name))
-    agg = df.groupby([column_name]).sum()
     print(agg)
-
-    percentage_values = round(agg.apply(lambda x: 100 * x / float(x.sum())), 2)
     print(percentage_values)
 
+    _plot_column(percentage_values, column_name)
+    _show(output)
+
+
+@stage
+def _plot_column(percentage_values: pd.DataFrame, column_name: str) -> None:
+    """
+    Plots the percentage values computed by column_tables().
+
+    :param percentage_values: The percentage values.
+    :param column_name: The column the values were aggregated by.
+    :return: No return value.
+    """
     percentage_values.plot(kind='bar', title=column_name)
-    plt.show()
 
 
-def plot_seasonal(df: pd.DataFrame, end: str = '2013-09-22', start: str = '2009-01-01') -> None:
+@stage
+def entity_table(df: Union[pd.DataFrame, PreparedDataset], end: str = '2013-09-22', start: str = '2009-01-01',
+                 min_breaches: int = 2) -> pd.DataFrame:
+    """
+    This function does the aggregation for analyze_entities(): the number of breaches of every covered entity, the
+    number of states they were reported in, the individuals affected and the dates of the first and last breach. The
+    entities are those found by add_entities(); if they aren't in the data yet, they are resolved within the timeframe.
+
+    :param df: The dataframe containing the breaches, or the prepared dataset from prepare_dataset().
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :param min_breaches: The smallest number of breaches of the entities to keep.
+    :return: The entities with at least min_breaches breaches, the most breached first, indexed by their id and name.
+
+    >>> df = pd.DataFrame([['Aetna', 'CT', 'Health Plan', 'No', 13, 'Loss', 'Email', 'Lost via Email', pd.Timestamp('2012-02-15')], ['Aetna, Inc.', 'NY', 'Health Plan', 'No', 7, 'Theft', 'Laptop', 'Laptop stolen', pd.Timestamp('2013-03-02')], ['Kmart', 'MI', 'Healthcare Provider', 'No', 5, 'Theft', 'Paper', 'Records stolen', pd.Timestamp('2012-05-02')]], columns=['Name of Covered Entity', 'State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> entity_table(prepare_dataset(df))[['Breaches', 'States', 'Individuals Affected']]  # doctest: +NORMALIZE_WHITESPACE
+                      Breaches  States  Individuals Affected
+    Entity ID Entity
+    0         Aetna          2       2                  20.0
+    """
+    df = _clean_window(df, end, start)
+    if 'Entity ID' not in df.columns:
+        df = add_entities(df)
+    df = df.loc[df['Entity ID'] >= 0]
+
+    grouped = df.groupby(_group_keys(df, ['Entity ID', 'Entity']))
+    table = grouped.agg(**{'Breaches': ('State', 'size'), 'States': ('State', 'nunique'),
+                           'Individuals Affected': ('Individuals Affected', 'sum'),
+                           'First Breach': ('Breach Submission Date', 'min'),
+                           'Last Breach': ('Breach Submission Date', 'max')})
+    table = _widen_sums(table.loc[table['Breaches'] >= min_breaches])
+
+    return table.sort_values(['Breaches', 'Individuals Affected'], ascending=False, kind='mergesort')
+
+
+@stage
+def analyze_entities(df: Union[pd.DataFrame, PreparedDataset], end: str = '2013-09-22', start: str = '2009-01-01',
+                     output: str = None, k: int = 10, min_breaches: int = 2) -> None:
+    """
+    This function finds the covered entities that were breached more than once, counting the breaches of an entity
+    together even when its name is spelled in different ways, and plots the number of breaches of the most breached
+    ones.
+
+    :param df: The dataframe containing the breaches, or the prepared dataset from prepare_dataset().
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :param output: The file to save the plot to. If it is not given, the plot is shown instead.
+    :param k: The number of entities to print and plot.
+    :param min_breaches: The smallest number of breaches of the entities to count.
+    :return: Prints all the required information inside the function. No return value.
+    """
+    data = df.data if isinstance(df, PreparedDataset) else df
+    if 'Name of Covered Entity' not in data.columns and 'Entity ID' not in data.columns:
+        print("The data has no names of covered entities.")
+        return
+
+    table = entity_table(df, end, start, min_breaches)
+
+    print("{} covered entities have at least {} breaches. The most breached ones:".format(len(table), min_breaches))
+    print(table.head(k))
+
+    _plot_entities(table.head(k))
+    _show(output)
+
+
+@stage
+def _plot_entities(table: pd.DataFrame) -> None:
+    """
+    Plots the number of breaches of the entities computed by entity_table().
+
+    :param table: The entities.
+    :return: No return value.
+    """
+    table.droplevel('Entity ID').plot(y='Breaches', kind='barh', legend=False, xlabel="Number of data breaches",
+                                      ylabel="Covered entity", title="Covered entities with the most data breaches")
+
+
+@stage
+def monthly_table(df: Union[pd.DataFrame, PreparedDataset], end: str = '2013-09-22',
+                  start: str = '2009-01-01') -> pd.DataFrame:
+    """
+    This function does the aggregation for plot_seasonal() and check_trends(): the number of breaches and the sums of
+    the numeric columns in every month of the timeframe.
+
+    :param df: The dataframe containing the values to be aggregated, or the prepared dataset from prepare_dataset().
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :return: The aggregated values, indexed by year and month.
+    """
+    if isinstance(df, PreparedDataset):
+        return rollup_cube(_dataset_cube(df), ['Year', 'Month'], end, start, df.data)
+
+    df = _clean_window(df, end, start)
+    dates = pd.DatetimeIndex(df['Breach Submission Date'])
+    grouped = df.groupby([dates.year.rename('Year'), dates.month.rename('Month')])
+
+    date = grouped.sum()
+    date.insert(0, 'Breaches', grouped.size())
+    return date
+
+
+@stage
+def plot_seasonal(df: Union[pd.DataFrame, PreparedDataset], end: str = '2013-09-22', start: str = '2009-01-01',
+                  output: str = None, normalize: bool = False) -> None:
     """
     This function plots the yearly aggregated values of the effects of data breaches, superimposed on each other to
     look at any seasonal trends. Additionally, it calls the adjust_time_limits() function to set the timeframe to a
-    desired value.
-    :param df: The dataframe containing the values to be aggregated and visualized.
+    desired value. A prepared dataset is aggregated from its cube instead (see rollup_cube()).
+    :param df: The dataframe containing the values to be aggregated and visualized, or the prepared dataset from
+    prepare_dataset().
     :param end: The end date of the desired timeframe.
     :param start: The start date of the desired timeframe.
+    :param output: The file to save the plot to. If it is not given, the plot is shown instead.
+    :param normalize: Whether to plot the seasonal index of every month (see seasonal_index()) instead of the number of
+    individuals affected, so that the years are on the same scale.
     :return: The function plots the aggregated values. No return value.
 
     """
+    if normalize:
+        if not isinstance(df, PreparedDataset):
+            df = prepare_dataset(df)
+        _plot_seasonal(seasonal_index(df, end, start), ylabel="Individuals affected relative to the average month")
+    else:
+        _plot_seasonal(monthly_table(df, end, start))
+    _show(output)
 
-    df = adjust_time_limits(df, end, start)
-
-    df = cleanup(df)
 
-    df['Year'] = pd.DatetimeIndex(df['Breach Submission Date']).year
-    df['Month'] = pd.DatetimeIndex(df['Breach Submission Date']).month
+@stage
+def _plot_seasonal(date: pd.DataFrame, ylabel: str = "Number of Individuals affected") -> None:
+    """
+    Plots the individuals affected every month computed by monthly_table() or seasonal_index(), with one line for every
+    year.
 
+    :param date: The aggregated values, indexed by year and month.
+    :param ylabel: The label of the vertical axis.
+    :return: No return value.
+    """
     flag = 0
-    date = df.groupby(['Year', 'Month']).sum()
 
     for i, j in date.groupby(level=0):
 
@@ -353,79 +1969,351 @@ def plot_seasonal(df: pd.DataFrame, end: str = '2013-09-22', start: str = '2009-
             continue
         date.loc[i].plot(y='Individuals Affected', ax=ax, figsize=(16, 10), use_index=False, grid=True, label=i,
                          legend=True)
-        ax.set(xlabel="Month", ylabel="Number of Individuals affected",
-               title="Number of Individuals affected every year")
-    plt.show()
+        ax.set(xlabel="Month", ylabel=ylabel, title="Number of Individuals affected every year")
 
 
-def check_trends(df: pd.DataFrame, end: str = '2013-09-22', start: str = '2009-01-01') -> None:
+@stage
+def check_trends(df: Union[pd.DataFrame, PreparedDataset], end: str = '2013-09-22', start: str = '2009-01-01',
+                 output: str = None, days: int = None) -> None:
     """
     This function counts the number of data breaches between the specified timeframe and plots them, essentially
-    showing us a trend of data breaches in the United States during that period of time.
+    showing us a trend of data breaches in the United States during that period of time. A prepared dataset is counted
+    from its cube instead (see rollup_cube()).
 
-    :param df: The dataframe containing the values to be aggregated and visualized.
+    :param df: The dataframe containing the values to be aggregated and visualized, or the prepared dataset from
+    prepare_dataset().
     :param end: The end date of the desired timeframe.
     :param start: The start date of the desired timeframe.
+    :param output: The file to save the plot to. If it is not given, the plot is shown instead.
+    :param days: If it is given, the breaches of the last this many days are plotted for every day of the timeframe
+    (see rolling_trend()) instead of the breaches of every month.
     :return: The function plots the aggregated values. No return value.
     """
-    df = adjust_time_limits(df, end, start)
-
-    df = cleanup(df)
-
-    df['Year'] = pd.DatetimeIndex(df['Breach Submission Date']).year
-    df['Month'] = pd.DatetimeIndex(df['Breach Submission Date']).month
-
-    date = df.groupby(['Year', 'Month']).count()
+    if days is not None:
+        if not isinstance(df, PreparedDataset):
+            df = prepare_dataset(df)
+        trend = rolling_trend(df, days).loc[pd.Timestamp(start):pd.Timestamp(end)]
+        _plot_trends(trend, xlabel="Date", ylabel="Number of data breaches in the last {} days".format(days))
+    else:
+        _plot_trends(monthly_table(df, end, start))
+    _show(output)
+
+
+@stage
+def _plot_trends(date: pd.DataFrame, xlabel: str = "(Year, Month)", ylabel: str = "Number of data breaches") -> None:
+    """
+    Plots the number of data breaches every month computed by monthly_table(), or every day computed by
+    rolling_trend().
 
-    date.plot(y='Individuals Affected', grid=True, legend=False, xlabel="(Year, Month)",
-              ylabel="Number of data breaches", title="Number of data breaches in the US")
+    :param date: The aggregated values, indexed by year and month, or by date.
+    :param xlabel: The label of the horizontal axis.
+    :param ylabel: The label of the vertical axis.
+    :return: No return value.
+    """
+    date.plot(y='Breaches', grid=True, legend=False, xlabel=xlabel, ylabel=ylabel,
+              title="Number of data breaches in the US")
 
-    plt.show()
 
-def analyze_multi_column(df: pd.DataFrame, col1: str, col2: str, end: str = '2013-09-22', start: str = '2009-01-01') -> None:
+@stage
+def analyze_multi_column(df: Union[pd.DataFrame, PreparedDataset], col1: Union[str, list], col2: str,
+                         end: str = '2013-09-22', start: str = '2009-01-01', output: str = None, k: int = 1) -> None:
     """
     This function helps us analyze data breaches by more than one category. We use it to look at the type of breaches
     in each state, or the location of breaches in each state. From this, we can aggregate these values to look at the
     highest contributors to data breaches in all the US states. To do this, we first group by the state and the
-    second category (type or location of breach), which results in a multi index. Then we create a new column of the
-    second level of the multi index, which is essentially the type or location value. And then we select the maximum
-    value of the first level of the multi index (the state). And finally we can group by the new column we created
-    and plot the occurrences of data breaches by their cause (either type or location).
-
-    :param df: The dataframe containing the columns to be aggregated and analyzed.
-    :param col1: The first column to aggregate by.
+    second category (type or location of breach), which results in a multi index. Then we rank the values of the
+    second category (the causes) within each state with top_k(), and keep the highest ranked ones. And finally we can
+    group by the top cause of every state and plot the occurrences of data breaches by their cause (either type or
+    location). When both columns are dimensions of the cube of a prepared dataset, the first aggregation is done on
+    the cube.
+
+    :param df: The dataframe containing the columns to be aggregated and analyzed, or the prepared dataset from
+    prepare_dataset().
+    :param col1: The first column to aggregate by, or a list of columns.
     :param col2: The second column to aggregate by.
     :param end: The end date of the desired timeframe.
     :param start: The start date of the desired timeframe.
+    :param output: The file to save the plot to. If it is not given, the plot is shown instead.
+    :param k: The number of causes printed for every value of the first column. Only the top one is plotted.
     :return: Prints and plots all the required information inside the function. No return value.
+
+    >>> df = pd.DataFrame([['CA', 'Health Plan', 'Yes', 13, 'Loss', 'Email', 'Lost via Email', '2010-02-15'], ['CA', 'Health Plan', 'No', 900, 'Theft', 'Laptop', 'Laptop stolen', '2010-03-02'], ['CA', 'Health Plan', 'No', 7, 'Loss', 'Laptop', 'Laptop lost', '2010-03-05']], columns=['State', 'Covered Entity Type', 'Business Associate Present', 'Individuals Affected', 'Type of Breach', 'Location of Breached Information', 'Web Description', 'Breach Submission Date'])
+    >>> analyze_multi_column(df, 'State', 'Type of Breach', k=2)  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
+                Cause  Breaches  ...  Individuals Affected  Covered Entities Involved
+    State Rank                   ...
+    CA    1      Loss         2  ...                  20.0                          2
+          2     Theft         1  ...                 900.0                          1
+    <BLANKLINE>
+    [2 rows x 5 columns]
     """
-    df = adjust_time_limits(df, end, start)
-    df = cleanup(df)
+    df3 = multi_column_table(df, col1, col2, end, start, k)
+    print(df3)
 
-    df2 = df.groupby([col1, col2]).sum()
+    _plot_multi_column(df3, col2)
+    _show(output)
 
-    df2['Cause'] = df2.index.get_level_values(1)
 
-    df3 = df2.groupby(level=0).apply(max)
-    print(df3)
+@stage
+def multi_column_table(df: Union[pd.DataFrame, PreparedDataset], col1: Union[str, list], col2: str,
+                       end: str = '2013-09-22', start: str = '2009-01-01', k: int = 1) -> pd.DataFrame:
+    """
+    This function does the aggregation for analyze_multi_column(): the number of breaches and the sums of the numeric
+    columns for every value of the second column (the cause) within every value of the first column, of which only
+    the top k causes are kept (see top_k()). Every row holds the values of a single cause, named in the 'Cause' column.
+
+    :param df: The dataframe containing the columns to be aggregated, or the prepared dataset from prepare_dataset().
+    :param col1: The first column to aggregate by, or a list of columns.
+    :param col2: The second column to aggregate by.
+    :param end: The end date of the desired timeframe.
+    :param start: The start date of the desired timeframe.
+    :param k: The number of causes to keep for every value of the first column.
+    :return: The top causes, indexed by the first column, and by their 'Rank' as well if k is more than 1.
+    """
+    groups = [col1] if isinstance(col1, str) else list(col1)
+
+    if isinstance(df, PreparedDataset) and all(column in CUBE_DIMENSIONS for column in groups + [col2]):
+        df2 = rollup_cube(_dataset_cube(df), groups + [col2], end, start, df.data)
+    else:
+        df = _clean_window(df, end, start)
+        measures = [column for column in df.columns if column in AGGREGATE_SUMS]
+        grouped = df.groupby(_group_keys(df, groups + [col2]))
+        df2 = grouped[measures].sum()
+        df2.insert(0, 'Breaches', grouped.size())
+        df2 = _widen_sums(df2)
+
+    df3 = top_k(df2, groups, k).rename(columns={col2: 'Cause'})
+    return df3.droplevel('Rank') if k == 1 else df3
+
+
+@stage
+def top_k(table: pd.DataFrame, groups: list, k: int = 1, by: tuple = ('Breaches', 'Individuals Affected')) -> \
+        pd.DataFrame:
+    """
+    This function keeps the k highest ranked rows of every group of an aggregated table. The rows are ranked by the
+    first of the 'by' columns, from the highest value to the lowest. Ties are broken by the rest of the 'by' columns,
+    and then by the values of the other index levels, in ascending order, so the result doesn't depend on the order of
+    the rows. The whole table is sorted once and the rows are numbered within their groups, instead of calling a
+    function for every group.
+
+    :param table: The aggregated table, indexed by the group columns and the columns that are ranked.
+    :param groups: The index levels that make up the groups.
+    :param k: The number of rows to keep in every group.
+    :param by: The columns to rank by.
+    :return: The kept rows, indexed by the group columns and their 'Rank' (starting from 1). The other index levels
+    become columns.
+
+    >>> table = pd.DataFrame({'State': ['CA', 'CA', 'CA', 'NY'], 'Cause': ['Loss', 'Theft', 'Hacking', 'Loss'], 'Breaches': [2, 5, 2, 1], 'Individuals Affected': [10.0, 4.0, 10.0, 3.0]}).set_index(['State', 'Cause'])
+    >>> top_k(table, ['State'], 2)  # doctest: +NORMALIZE_WHITESPACE
+                  Cause  Breaches  Individuals Affected
+    State Rank
+    CA    1       Theft         5                   4.0
+          2     Hacking         2                  10.0
+    NY    1        Loss         1                   3.0
+    """
+    items = [name for name in table.index.names if name not in groups]
+    by = [column for column in by if column in table.columns]
+
+    flat = table.reset_index()
+    ascending = [True] * len(groups) + [False] * len(by) + [True] * len(items)
+    flat = flat.sort_values(groups + by + items, ascending=ascending, kind='mergesort', na_position='last')
+    flat['Rank'] = flat.groupby(_group_keys(flat, groups), sort=False, dropna=False).cumcount() + 1
+
+    return flat.loc[flat['Rank'] <= k].set_index(groups + ['Rank'])[items + list(table.columns)]
+
+
+@stage
+def _plot_multi_column(df3: pd.DataFrame, col2: str) -> None:
+    """
+    Plots the number of values of the first column that each cause is the highest contributor for.
+
+    :param df3: The top causes computed by multi_column_table().
+    :param col2: The second column the values were aggregated by.
+    :return: No return value.
+    """
+    if 'Rank' in df3.index.names:
+        df3 = df3.xs(1, level='Rank')
     df3.groupby(['Cause']).count().plot(kind = 'bar', y='Individuals Affected', grid=True, legend=False, xlabel= col2,
               ylabel="Number of data breaches", title="Highest contributors of data breaches in all states", figsize=(10,10), rot=0)
-    plt.show()
+
+
+@stage
+def _show(output: str = None) -> None:
+    """
+    Shows the current figure, or saves it to a file and closes it if a file is given, which works without a display.
+
+    :param output: The file to save the figure to.
+    :return: No return value.
+    """
+    if output is None:
+        plt.show()
+        return
+
+    plt.savefig(output, bbox_inches='tight')
+    plt.close('all')
+
+
+@stage
+def render_report(df: Union[pd.DataFrame, PreparedDataset], output_dir: str, analyses: tuple = REPORT_ANALYSES,
+                  formats: tuple = ('png', 'svg'), jobs: int = None) -> dict:
+    """
+    This function renders the figures of the analysis functions to files instead of showing them, so that the report
+    can be made on a server without a display. The data is prepared once, and every analysis then runs in its own
+    process in a pool, which draws the figure with the non-interactive 'Agg' backend. The tables the analysis
+    functions print are saved as CSV and JSON files next to the figures, and a manifest.json file lists everything that
+    was written.
+
+    :param df: The original dataframe or the prepared dataset.
+    :param output_dir: The folder the report is written to.
+    :param analyses: The (name, analysis function, arguments) of every figure, see REPORT_ANALYSES.
+    :param formats: The file formats each figure is saved in.
+    :param jobs: The number of processes to use. By default, one for every CPU. With 1, no pool is used, and the
+    figures are drawn in this process, whose backend is switched back when the report is done.
+    :return: The manifest.
+    """
+    global _report_dataset
+    if not isinstance(df, PreparedDataset):
+        df = prepare_dataset(df)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    start_time = time.perf_counter()
+    if jobs == 1:
+        # Without a pool, the figures are drawn in this process, so its backend and dataset are put back afterwards.
+        previous_dataset, previous_backend = _report_dataset, plt.get_backend()
+        _start_report_worker(df)
+        try:
+            reports = [_render_analysis(analysis, output_dir, formats) for analysis in analyses]
+        finally:
+            _report_dataset = previous_dataset
+            plt.switch_backend(previous_backend)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_start_report_worker, initargs=(df,)) as pool:
+            reports = list(pool.map(_render_analysis, analyses, repeat(output_dir), repeat(formats)))
+
+    manifest = {'source': df.key, 'seconds': round(time.perf_counter() - start_time, 3), 'reports': reports}
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    return manifest
+
+
+# The prepared dataset each process of render_report() works on, set once when the process starts.
+_report_dataset = None
+
+
+def _start_report_worker(dataset: PreparedDataset) -> None:
+    """
+    Gets a process ready to render figures: it keeps the dataset and switches matplotlib to a backend that doesn't need
+    a display.
+
+    :param dataset: The prepared dataset.
+    :return: No return value.
+    """
+    global _report_dataset
+    _report_dataset = dataset
+    plt.switch_backend('Agg')
+
+
+@stage
+def _render_analysis(analysis: tuple, output_dir: str, formats: tuple) -> dict:
+    """
+    Runs one of the analyses of render_report(), and saves its figure and tables.
+
+    :param analysis: The name, analysis function and arguments.
+    :param output_dir: The folder the files are written to.
+    :param formats: The file formats the figure is saved in.
+    :return: The entry of the manifest for this analysis.
+    """
+    name, function, arguments = analysis
+    start_time = time.perf_counter()
+
+    if function == 'analyze_column':
+        agg, percentage_values = column_tables(_report_dataset, *arguments)
+        tables = {'aggregated': agg, 'percentages': percentage_values}
+        _plot_column(percentage_values, arguments[0])
+    elif function == 'plot_seasonal':
+        date = monthly_table(_report_dataset, *arguments)
+        tables = {'monthly': date}
+        _plot_seasonal(date)
+    elif function == 'check_trends':
+        date = monthly_table(_report_dataset, *arguments)
+        tables = {'monthly': date[['Breaches']]}
+        _plot_trends(date)
+    elif function == 'analyze_multi_column':
+        df3 = multi_column_table(_report_dataset, *arguments)
+        tables = {'top_causes': df3}
+        _plot_multi_column(df3, arguments[1])
+    else:
+        raise ValueError("{} is not one of the analysis functions.".format(function))
+
+    figures = []
+    for file_format in formats:
+        figures.append('{}.{}'.format(name, file_format))
+        plt.savefig(os.path.join(output_dir, figures[-1]), bbox_inches='tight')
+    plt.close('all')
+
+    files = []
+    for table_name, table in tables.items():
+        files.append('{}.{}.csv'.format(name, table_name))
+        table.to_csv(os.path.join(output_dir, files[-1]))
+        files.append('{}.{}.json'.format(name, table_name))
+        table.reset_index().to_json(os.path.join(output_dir, files[-1]), orient='records', date_format='iso')
+
+    return {'name': name, 'analysis': function, 'arguments': list(arguments), 'figures': figures, 'tables': files,
+            'seconds': round(time.perf_counter() - start_time, 3)}
 
 
 if __name__ == '__main__':
-    file_path = 'breach_report.csv'
+    parser = argparse.ArgumentParser(description='Analyze the health data breaches reported to the HHS.')
+    parser.add_argument('--file', default='breach_report.csv', help='The breach report to analyze.')
+    parser.add_argument('--report', metavar='DIR', help='Save the figures and tables to DIR instead of showing them.')
+    parser.add_argument('--formats', nargs='+', default=['png', 'svg'], help='The file formats of the saved figures.')
+    parser.add_argument('--jobs', type=int, help='The number of processes used to render the report.')
+    parser.add_argument('--update', action='store_true',
+                        help='Only read the rows added to the file since the last run with --update.')
+    parser.add_argument('--search', metavar='QUERY',
+                        help='Only analyze the breaches whose descriptions match QUERY, e.g. \'"unencrypted laptop"\'.')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Time every stage and save the results to FILE, as JSON or, if FILE ends with .folded, as '
+                             'folded stacks for a flame graph. Use --jobs 1 to include the report stages.')
+    args = parser.parse_args()
+
+    file_path = args.file
+
+    recording = breach_profiling.profile(memory=True) if args.profile else nullcontext()
+    with recording as profiler:
+        if args.update:
+            df1 = update_dataset(file_path)
+        else:
+            df1 = load_dataset(file_path)
 
-    df1 = read_file(file_path)
+        if args.search:
+            df1 = search_dataset(df1, args.search)
+            print("{} breaches match {!r}.".format(len(df1.data), args.search))
 
-    analyze_column(df1, 'Type of Breach', '2013-09-22')
+        if args.report:
+            manifest = render_report(df1, args.report, formats=tuple(args.formats), jobs=args.jobs)
+            print("Rendered {} figures to {} in {} seconds.".format(len(manifest['reports']), args.report,
+                                                                   manifest['seconds']))
+        else:
+            analyze_column(df1, 'Type of Breach', '2013-09-22')
+
+            analyze_column(df1, 'Location of Breach', '2013-09-22')
 
-    analyze_column(df1, 'Location of Breach', '2013-09-22')
+            plot_seasonal(df1, '2022-09-22')
 
-    plot_seasonal(df1, '2022-09-22')
+            check_trends(df1, '2022-09-22')
 
-    check_trends(df1, '2022-09-22')
+            analyze_multi_column(df1, 'State', 'Location of Breach', '2022-09-22')
 
-    analyze_multi_column(df1, 'State', 'Location of Breach', '2022-09-22')
+            analyze_multi_column(df1, 'State', 'Type of Breach', '2022-09-22')
 
-    analyze_multi_column(df1, 'State', 'Type of Breach', '2022-09-22')
+    if args.profile:
+        if args.profile.endswith('.folded'):
+            with open(args.profile, 'w') as file:
+                file.write(profiler.folded())
+        else:
+            profiler.to_json(args.profile)
+        for total in profiler.summary()[:10]:
+            print("{:<24} {:>6} calls {:>10.3f} s {:>10.3f} s self {:>10} MB peak".format(
+                total['stage'], total['calls'], total['seconds'], total['self_seconds'], total['peak_mb']))
@@ -0,0 +1,298 @@
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import io
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+
+import IS597PR_Final_Project as breaches
+
+
+# The number of rows the benchmark is run with by default.
+DEFAULT_SIZES = (10000, 100000, 1000000, 10000000)
+
+# The rows are generated and written this many at a time, so that the generator itself doesn't need much memory.
+GENERATOR_CHUNK = 1000000
+
+# The states, with the District of Columbia and Puerto Rico. The first ones are given the most breaches.
+STATES = ('CA', 'TX', 'FL', 'NY', 'IL', 'PA', 'OH', 'MI', 'GA', 'NC', 'NJ', 'VA', 'WA', 'AZ', 'MA', 'TN', 'IN', 'MO',
+          'MD', 'WI', 'CO', 'MN', 'SC', 'AL', 'LA', 'KY', 'OR', 'OK', 'CT', 'UT', 'IA', 'NV', 'AR', 'MS', 'KS', 'NM',
+          'NE', 'WV', 'ID', 'HI', 'NH', 'ME', 'MT', 'RI', 'DE', 'SD', 'ND', 'AK', 'DC', 'VT', 'WY', 'PR')
+
+# The values that make up 'Type of Breach' and 'Location of Breached Information', with how often each one is the main
+# value of a breach. Some breaches list more than one value, separated by commas and in alphabetical order.
+BREACH_TYPES = (('Hacking/IT Incident', 0.09), ('Improper Disposal', 0.04), ('Loss', 0.1), ('Other', 0.06),
+                ('Theft', 0.5), ('Unauthorized Access/Disclosure', 0.19), ('Unknown', 0.02))
+BREACH_LOCATIONS = (('Desktop Computer', 0.12), ('Electronic Medical Record', 0.05), ('Email', 0.07),
+                    ('Laptop', 0.22), ('Network Server', 0.1), ('Other', 0.12),
+                    ('Other Portable Electronic Device', 0.1), ('Paper/Films', 0.22))
+
+COVERED_ENTITY_TYPES = (('Healthcare Provider', 0.72), ('Health Plan', 0.13), ('Business Associate', 0.13),
+                        ('Healthcare Clearing House', 0.02))
+
+DESCRIPTIONS = ('A laptop containing the protected health information (PHI) of patients was stolen from a vehicle.',
+                'Paper records were improperly disposed of in an unsecured dumpster.',
+                'An unauthorized employee accessed the electronic health records of several patients.',
+                'A phishing email gave a third party access to an email account containing ePHI.',
+                'A network server was infected with ransomware, and the ePHI on it was encrypted.')
+
+
+def generate_breaches(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    This function generates breach records that look like the ones in the breach report: the same columns, the same
+    date format, values of 'Type of Breach' and 'Location of Breached Information' that list more than one cause, a few
+    of the states having most of the breaches, more breaches in the later years, and some missing values. The same
+    seed always gives the same records.
+
+    :param rows: The number of records to generate.
+    :param seed: The seed of the random number generator.
+    :return: The dataframe of records, as it would be read from the file without parsing the dates.
+
+    >>> df = generate_breaches(5, seed=1)
+    >>> list(df.columns) == list(pd.read_csv(breaches._full_path('breach_report.csv'), encoding='latin1', nrows=0).columns)
+    True
+    >>> len(df), df.equals(generate_breaches(5, seed=1))
+    (5, True)
+    """
+    rng = np.random.default_rng(seed)
+
+    state_weights = 1 / np.arange(1, len(STATES) + 1) ** 1.1
+    states = np.array(STATES, dtype=object)[rng.choice(len(STATES), rows, p=state_weights / state_weights.sum())]
+
+    # The number of breaches grows over the years, so later days are more likely to be picked.
+    first, last = pd.Timestamp('2009-10-21'), pd.Timestamp('2016-07-31')
+    day = (rng.triangular(0, 1, 1, rows) * (last - first).days).astype('int64')
+    days, codes = np.unique(day, return_inverse=True)
+    dates = (first + pd.to_timedelta(days, unit='D')).strftime('%m/%d/%y').to_numpy(dtype=object)[codes]
+
+    df = pd.DataFrame({
+        'Name of Covered Entity': _entity_names(rng, rows),
+        'State': states,
+        'Covered Entity Type': _pick(rng, COVERED_ENTITY_TYPES, rows),
+        'Individuals Affected': np.maximum(500, rng.lognormal(8, 1.5, rows)).round().astype('float64'),
+        'Breach Submission Date': dates,
+        'Type of Breach': _multi_valued(rng, BREACH_TYPES, rows),
+        'Location of Breached Information': _multi_valued(rng, BREACH_LOCATIONS, rows),
+        'Business Associate Present': np.where(rng.random(rows) < 0.22, 'Yes', 'No').astype(object),
+        'Web Description': np.array(DESCRIPTIONS, dtype=object)[rng.integers(len(DESCRIPTIONS), size=rows)],
+    })
+
+    for column, share in [('State', 0.006), ('Covered Entity Type', 0.025), ('Type of Breach', 0.008),
+                          ('Location of Breached Information', 0.006), ('Web Description', 0.25)]:
+        df.loc[rng.random(rows) < share, column] = np.nan
+
+    return df
+
+
+def _pick(rng: np.random.Generator, values: tuple, rows: int) -> np.ndarray:
+    """
+    Picks one of the values for every row, as often as its weight says.
+
+    :param rng: The random number generator.
+    :param values: The (value, weight) pairs.
+    :param rows: The number of rows.
+    :return: The picked values.
+    """
+    weights = np.array([weight for value, weight in values])
+    choices = rng.choice(len(values), rows, p=weights / weights.sum())
+    return np.array([value for value, weight in values], dtype=object)[choices]
+
+
+def _multi_valued(rng: np.random.Generator, values: tuple, rows: int, extra: float = 0.08) -> np.ndarray:
+    """
+    Generates a column like 'Type of Breach', where every row has a main value and sometimes a few others, listed in
+    alphabetical order and separated by commas. The combinations are kept as bit masks until the end, so every
+    distinct string is only built once.
+
+    :param rng: The random number generator.
+    :param values: The (value, weight) pairs, in alphabetical order.
+    :param rows: The number of rows.
+    :param extra: The chance that each of the other values is listed as well.
+    :return: The generated values.
+    """
+    weights = np.array([weight for value, weight in values])
+    main = rng.choice(len(values), rows, p=weights / weights.sum())
+
+    masks = np.left_shift(1, main)
+    for bit in range(len(values)):
+        masks |= (rng.random(rows) < extra).astype('int64') << bit
+
+    names = [value for value, weight in values]
+    lookup = np.array([', '.join(name for bit, name in enumerate(names) if mask >> bit & 1)
+                       for mask in range(1 << len(names))], dtype=object)
+    return lookup[masks]
+
+
+def _entity_names(rng: np.random.Generator, rows: int) -> np.ndarray:
+    """
+    Generates the names of the covered entities. There are about a third as many entities as rows, and a few of them
+    have many breaches.
+
+    :param rng: The random number generator.
+    :param rows: The number of rows.
+    :return: The names.
+    """
+    entities = max(1, rows // 3)
+    ids = np.minimum(rng.zipf(1.3, rows), entities)
+    suffixes = np.array(['Medical Center', 'Health Plan', 'Clinic', 'Hospital', 'Health, LLC'], dtype=object)
+    unique_ids, codes = np.unique(ids, return_inverse=True)
+    names = np.array(['Entity {} {}'.format(i, suffixes[i % len(suffixes)]) for i in unique_ids], dtype=object)
+    return names[codes]
+
+
+def write_breaches(path: str, rows: int, seed: int = 0) -> None:
+    """
+    Writes generated breach records to a CSV file in the format of the breach report. The records are generated and
+    written GENERATOR_CHUNK rows at a time, each chunk with its own seed derived from the given one.
+
+    :param path: The path of the file.
+    :param rows: The number of records.
+    :param seed: The seed of the random number generator.
+    :return: No return value.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(max(1, -(-rows // GENERATOR_CHUNK)))
+    with open(path, 'w', encoding='latin1', newline='') as file:
+        for i, chunk_seed in enumerate(seeds):
+            chunk_rows = min(GENERATOR_CHUNK, rows - i * GENERATOR_CHUNK)
+            generate_breaches(chunk_rows, chunk_seed).to_csv(file, index=False, header=(i == 0))
+
+
+def run_benchmark(sizes: tuple = DEFAULT_SIZES, seed: int = 0, directory: str = None) -> dict:
+    """
+    This function measures how every stage of the analysis scales. For each size, it writes a generated breach report
+    with that many rows, and then runs read_file(), adjust_time_limits(), cleanup(), fix_columns(), prepare_dataset()
+    and the four analysis functions on it, recording the wall time of every stage, the rows that went in and came out,
+    and the peak memory the stage allocated on top of what was already in use (measured with tracemalloc, which slows
+    the stages down a little). The figures are drawn with the 'Agg' backend and saved to the temporary folder.
+
+    :param sizes: The numbers of rows to run the benchmark with.
+    :param seed: The seed of the generated records.
+    :param directory: The folder the generated files are written to. By default, a temporary folder is used.
+    :return: The results, along with the versions of Python and the libraries they were measured with.
+    """
+    plt.switch_backend('Agg')
+    results = []
+
+    with tempfile.TemporaryDirectory(dir=directory) as folder:
+        for rows in sizes:
+            path = os.path.join(folder, 'breaches_{}.csv'.format(rows))
+            write_breaches(path, rows, seed)
+            figure = os.path.join(folder, 'figure.png')
+
+            tracemalloc.start()
+            try:
+                df = _measure(results, rows, 'read_file', rows, breaches.read_file, path)
+                _measure(results, rows, 'adjust_time_limits', len(df), breaches.adjust_time_limits, df,
+                         '2022-09-22')
+                _measure(results, rows, 'cleanup', len(df), breaches.cleanup, df)
+                _measure(results, rows, 'fix_columns', len(df), breaches.fix_columns,
+                         df.dropna(subset=['Type of Breach']), 'Type of Breach')
+                dataset = _measure(results, rows, 'prepare_dataset', len(df), breaches.prepare_dataset, df)
+                del df
+
+                cleaned = len(dataset.data)
+                _measure(results, rows, 'analyze_column', cleaned, breaches.analyze_column, dataset,
+                         'Type of Breach', '2022-09-22', '2009-01-01', figure)
+                _measure(results, rows, 'plot_seasonal', cleaned, breaches.plot_seasonal, dataset, '2022-09-22',
+                         '2009-01-01', figure)
+                _measure(results, rows, 'check_trends', cleaned, breaches.check_trends, dataset, '2022-09-22',
+                         '2009-01-01', figure)
+                _measure(results, rows, 'analyze_multi_column', cleaned, breaches.analyze_multi_column, dataset,
+                         'State', 'Type of Breach', '2022-09-22', '2009-01-01', figure)
+                del dataset
+            finally:
+                tracemalloc.stop()
+            os.remove(path)
+
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'seed': seed, 'results': results}
+
+
+def _measure(results: list, size: int, stage: str, rows: int, function, *args):
+    """
+    Runs one stage of the benchmark and adds its measurements to the results. Anything the stage prints is discarded.
+
+    :param results: The list the measurements are added to.
+    :param size: The number of rows of the generated file.
+    :param stage: The name of the stage.
+    :param rows: The number of rows the stage was given.
+    :param function: The function to run.
+    :param args: The arguments of the function.
+    :return: Whatever the function returns.
+    """
+    gc.collect()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args)
+    seconds = time.perf_counter() - start_time
+
+    peak = tracemalloc.get_traced_memory()[1] - before
+    rows_out = len(result.data) if isinstance(result, breaches.PreparedDataset) else (
+        len(result) if isinstance(result, pd.DataFrame) else None)
+    results.append({'stage': stage, 'size': size, 'rows_in': rows, 'rows_out': rows_out, 'seconds': round(seconds, 4),
+                    'peak_mb': round(peak / 2 ** 20, 2)})
+    return result
+
+
+def compare_results(old: dict, new: dict, tolerance: float = 0.2) -> list:
+    """
+    Compares two sets of benchmark results and finds the stages that got slower or used more memory by more than the
+    tolerance, for the sizes that both of them were run with.
+
+    :param old: The results to compare against.
+    :param new: The new results.
+    :param tolerance: The fraction by which a measurement can grow before it counts as a regression.
+    :return: A list of the regressions.
+
+    >>> old = {'results': [{'stage': 'cleanup', 'size': 10, 'seconds': 1.0, 'peak_mb': 5.0}]}
+    >>> new = {'results': [{'stage': 'cleanup', 'size': 10, 'seconds': 1.5, 'peak_mb': 5.1}]}
+    >>> compare_results(old, new)
+    [{'stage': 'cleanup', 'size': 10, 'measure': 'seconds', 'old': 1.0, 'new': 1.5}]
+    """
+    baseline = {(result['stage'], result['size']): result for result in old['results']}
+    regressions = []
+    for result in new['results']:
+        before = baseline.get((result['stage'], result['size']))
+        if before is None:
+            continue
+        for measure in ('seconds', 'peak_mb'):
+            if result[measure] > before[measure] * (1 + tolerance):
+                regressions.append({'stage': result['stage'], 'size': result['size'], 'measure': measure,
+                                    'old': before[measure], 'new': result[measure]})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure how the breach analysis scales with generated data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='The numbers of rows to run the benchmark with.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the generated records.')
+    parser.add_argument('--output', default='benchmark_results.json', help='The file the results are written to.')
+    parser.add_argument('--compare', metavar='FILE', help='Earlier results to check the new ones against.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='The growth that counts as a regression.')
+    parser.add_argument('--dir', help='The folder the generated files are written to.')
+    args = parser.parse_args()
+
+    benchmark = run_benchmark(tuple(args.sizes), args.seed, args.dir)
+    with open(args.output, 'w') as file:
+        json.dump(benchmark, file, indent=2)
+
+    print(pd.DataFrame(benchmark['results']).to_string(index=False))
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare_results(json.load(file), benchmark, args.tolerance)
+        for regression in regressions:
+            print("Regression in {stage} with {size} rows: {measure} went from {old} to {new}.".format(**regression))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,503 @@
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from breach_profiling import stage
+
+
+# The words that only say what kind of organization an entity is. They are left out when names are compared, so
+# 'Walgreen Co.' and 'Walgreen' are the same name.
+LEGAL_WORDS = ('the', 'inc', 'incorporated', 'llc', 'llp', 'lp', 'ltd', 'pc', 'pa', 'pllc', 'plc', 'co', 'corp',
+               'corporation', 'company', 'dba')
+
+# Abbreviations that are written out when names are compared, so that both spellings are the same.
+ABBREVIATIONS = {'dept': 'department', 'univ': 'university', 'ctr': 'center', 'centre': 'center', 'hosp': 'hospital',
+                 'med': 'medical', 'assn': 'association', 'assoc': 'association', 'svcs': 'services',
+                 'svc': 'service', 'hlth': 'health', 'natl': 'national', 'intl': 'international', 'st': 'saint',
+                 'mt': 'mount', 'calif': 'california'}
+
+# Names are only scored against the names of the same state that share the first letters of one of their words, or of
+# the whole name (a block). A word has to be at least this long to be used for blocking.
+BLOCK_PREFIX = 4
+
+# Blocks with more names than this come from words that many names share, like 'health', and are not scored. The
+# names in them are still compared through their other words. This is what keeps the number of pairs close to linear.
+MAX_BLOCK_SIZE = 50
+
+# The smallest similarity (see similarity()) at which two names of the same state are the same entity.
+MATCH_THRESHOLD = 0.8
+
+
+def normalize_name(name: str) -> str:
+    """
+    Writes the name of a covered entity in a single way: in lower case, with '&' written as 'and', without punctuation,
+    abbreviations written out (see ABBREVIATIONS), and without the words in LEGAL_WORDS.
+
+    :param name: The name.
+    :return: The normalized name.
+
+    >>> normalize_name('Mid-America Kidney Stone Association, L.L.C.')
+    'mid america kidney stone association'
+    >>> normalize_name("Brigham & Women's Hosp.")
+    'brigham and womens hospital'
+    """
+    name = re.sub(r"[.']", '', name.lower().replace('&', ' and '))
+    words = [ABBREVIATIONS.get(word, word) for word in re.findall(r'[a-z0-9]+', name)]
+    return ' '.join(word for word in words if word not in LEGAL_WORDS)
+
+
+def similarity(first: str, second: str) -> float:
+    """
+    Measures how alike two normalized names are: the number of sequences of three characters (trigrams) that both have,
+    divided by the number that either has. Identical names have a similarity of 1, and names without any trigram in
+    common have a similarity of 0.
+
+    :param first: A normalized name.
+    :param second: The other normalized name.
+    :return: The similarity.
+
+    >>> round(similarity('walgreen', 'walgreens'), 2)
+    0.86
+    >>> similarity('mount sinai medical center', 'kmart')
+    0.0
+    """
+    return _jaccard(_trigrams(first), _trigrams(second))
+
+
+@dataclass
+class EntityIndex:
+    """
+    Everything resolve_entities() works out about the names of the covered entities, built by build_entity_index().
+    It is kept so that the names of new breaches can be resolved with update_entities() by scoring them only against
+    the names in their blocks, instead of comparing all the names again.
+
+    records: Every distinct pair of a state and a normalized name ('state', 'name'), and the smallest record it is
+    linked to through a chain of matching names ('component').
+    spellings: Every distinct pair of a state and a spelling of a name ('state', 'spelling'), its record ('record') and
+    the number of breaches that have it ('count').
+    blocks: The blocks of every record ('record', 'block'), including the ones with too many names to be scored.
+    links: The pairs of records ('first', 'second') that share a block and whose names are alike enough to be linked.
+    entities: The component ('component') and canonical name ('Entity') of every entity, indexed by its id.
+    """
+    records: pd.DataFrame
+    spellings: pd.DataFrame
+    blocks: pd.DataFrame
+    links: pd.DataFrame
+    entities: pd.DataFrame
+
+
+@stage
+def resolve_entities(names: pd.Series, states: pd.Series) -> pd.DataFrame:
+    """
+    This function finds the breaches of the same covered entity, even when its name is spelled in different ways, and
+    gives each entity an id. The names are normalized with normalize_name(), or only written in lower case if nothing
+    is left of them, and breaches whose normalized names are the same are of the same entity, whatever their state.
+    Other names are only compared with similarity() within their blocks: the names of the same state that share the
+    first BLOCK_PREFIX letters of a word or of the whole name. Names that are at least MATCH_THRESHOLD alike are the
+    same entity, and so are names linked through a chain of such pairs. Each entity is named after its most common
+    spelling, and the ids follow the alphabetical order of those names, so the same breaches always get the same ids.
+
+    :param names: The names of the covered entities.
+    :param states: The states of the breaches, with the same index.
+    :return: The 'Entity ID' and the canonical name ('Entity') of every breach, with the same index. Breaches without a
+    name have an id of -1.
+
+    >>> names = pd.Series(['Walgreen Co.', 'Walgreens', 'Kmart Corporation', 'Walgreen Co.', 'K-Mart', None])
+    >>> resolve_entities(names, pd.Series(['IL', 'IL', 'MI', 'TX', 'MI', 'NY']))
+       Entity ID        Entity
+    0          1  Walgreen Co.
+    1          1  Walgreen Co.
+    2          0        K-Mart
+    3          1  Walgreen Co.
+    4          0        K-Mart
+    5         -1          None
+    >>> resolve_entities(pd.Series(['Inc.', 'L.L.C.', 'Inc.']), pd.Series(['IL', 'TX', 'TX']))
+       Entity ID  Entity
+    0          0    Inc.
+    1          1  L.L.C.
+    2          0    Inc.
+    """
+    return entity_labels(build_entity_index(names, states), names, states)
+
+
+@stage
+def build_entity_index(names: pd.Series, states: pd.Series) -> EntityIndex:
+    """
+    Resolves the names of the covered entities like resolve_entities() does, and returns what it found instead of the
+    entity of every breach.
+
+    :param names: The names of the covered entities.
+    :param states: The states of the breaches, with the same index.
+    :return: The entity index.
+    """
+    return _index_spellings(_count_spellings(names, states))
+
+
+@stage
+def update_entities(index: EntityIndex, names: pd.Series, states: pd.Series, removed_names: pd.Series = None,
+                    removed_states: pd.Series = None) -> tuple:
+    """
+    This function adds the names of new breaches to an entity index, and takes out the names of removed breaches. Only
+    the spellings that aren't in the index yet are normalized, and only their new records are scored, against the
+    records in their blocks, so the names already in the index are never compared again. The entities the new records
+    link are merged, and only the entities whose breaches changed are named again. A block that grows past
+    MAX_BLOCK_SIZE isn't scored anymore, so the links that only came from it are taken away, and the entities they were
+    in are found again. The result is the same as building the index from all the breaches. In the rare case where a
+    record has no breaches left, the index is built again from its spellings instead.
+
+    :param index: The index built by build_entity_index().
+    :param names: The names of the new breaches.
+    :param states: The states of the new breaches, with the same index.
+    :param removed_names: The names of the removed breaches.
+    :param removed_states: The states of the removed breaches, with the same index.
+    :return: The updated index, and the new id of every entity of the old one, or None if the index was built again or
+    an entity was split, and the entity of every breach has to be found again with entity_labels().
+
+    >>> index = build_entity_index(pd.Series(['Walgreen Co.', 'Kmart']), pd.Series(['IL', 'MI']))
+    >>> index, ids = update_entities(index, pd.Series(['Walgreens', 'Aetna']), pd.Series(['IL', 'CT']))
+    >>> index.entities['Entity'].tolist(), ids.tolist()
+    (['Aetna', 'Kmart', 'Walgreen Co.'], [1, 2])
+    >>> entity_labels(index, pd.Series(['Walgreens', 'Kmart']), pd.Series(['IL', 'MI']))
+       Entity ID        Entity
+    0          2  Walgreen Co.
+    1          1         Kmart
+    """
+    changes = [_count_spellings(names, states)]
+    if removed_names is not None:
+        changes.append(_count_spellings(removed_names, removed_states).assign(count=lambda df: -df['count']))
+    changes = pd.concat(changes).groupby(['state', 'spelling'], sort=False, dropna=False)['count'].sum()
+    changes = changes.reset_index().merge(index.spellings.reset_index()[['state', 'spelling', 'index']], how='left',
+                                          on=['state', 'spelling'])
+
+    found = changes['index'].notna().to_numpy()
+    spellings = index.spellings.copy()
+    positions = changes.loc[found, 'index'].to_numpy(dtype='int64')
+    spellings.loc[positions, 'count'] += changes.loc[found, 'count'].to_numpy()
+    touched = spellings.loc[positions, 'record'].to_numpy()
+
+    # A record without any breaches left would take its links with it, so the index is built again without it.
+    empty = spellings['count'] <= 0
+    new = changes.loc[~found & (changes['count'] > 0).to_numpy(), ['state', 'spelling', 'count']]
+    if empty.any():
+        spellings = spellings.loc[~empty]
+        if not np.isin(touched[empty.loc[positions].to_numpy()], spellings['record']).all():
+            spellings = pd.concat([spellings[['state', 'spelling', 'count']], new], ignore_index=True)
+            return _index_spellings(spellings), None
+
+    # The new spellings are normalized, and the pairs of a state and a name that aren't a record yet become records.
+    codes, uniques = pd.factorize(new['spelling'].to_numpy(dtype=object))
+    keys = pd.DataFrame({'state': new['state'].to_numpy(dtype=object),
+                         'name': np.array([_record_name(spelling) for spelling in uniques], dtype=object)[codes]})
+    known = keys.merge(index.records.reset_index()[['state', 'name', 'index']], how='left', on=['state', 'name'])
+    added = keys.loc[known['index'].isna().to_numpy()].drop_duplicates(ignore_index=True)
+    added.index += len(index.records)
+    records = pd.concat([index.records[['state', 'name']], added])
+    new = new.assign(record=keys.merge(records.reset_index(), how='left', on=['state', 'name'])['index'].to_numpy())
+    spellings = pd.concat([spellings, new], ignore_index=True)
+
+    # The blocks of the new records are added, and the ones that they make grow past the limit are found.
+    grown = _blocks(added['state'], added['name'])
+    blocks = pd.concat([index.blocks, grown], ignore_index=True)
+    sizes = blocks.loc[blocks['block'].isin(grown['block']), 'block'].value_counts()
+    crossed = sizes.index[(sizes > MAX_BLOCK_SIZE) & (sizes - grown['block'].value_counts().loc[sizes.index]
+                                                       <= MAX_BLOCK_SIZE)]
+    previous = np.concatenate([index.records['component'].to_numpy(), added.index.to_numpy()])
+    roots = previous.copy()
+    links = index.links
+    group = np.array([], dtype='int64')
+
+    # The links between the records of a block that grew past the limit stay only if they share another block that is
+    # still scored. The components that lost links are found again from the links they have left.
+    inside = blocks.loc[blocks['block'].isin(crossed), 'record']
+    candidates = links.loc[(links['first'].isin(inside) & links['second'].isin(inside)).to_numpy()]
+    dropped = candidates.loc[~_supported(candidates, blocks)]
+    if len(dropped):
+        links = links.drop(dropped.index)
+        group = np.flatnonzero(np.isin(roots, roots[dropped['first'].to_numpy()]))
+        left, right = _same_names(records, group)
+        remaining = links.loc[links['first'].isin(group).to_numpy()]
+        left = np.searchsorted(group, np.concatenate([left, remaining['first'].to_numpy()]))
+        right = np.searchsorted(group, np.concatenate([right, remaining['second'].to_numpy()]))
+        roots[group] = group[_components(len(group), left, right)]
+
+    # The links of the new records merge the components of the old ones, which are found by their smallest records.
+    left, right = _same_names(records, added.index.to_numpy())
+    matches = _matches(records, blocks, added.index.to_numpy())
+    links = pd.concat([links, matches], ignore_index=True)
+    left = roots[np.concatenate([left, matches['first'].to_numpy()])]
+    right = roots[np.concatenate([right, matches['second'].to_numpy()])]
+    components = _components(len(records), left, right)[roots]
+    records = records.assign(component=components)
+
+    # Only the entities whose records were merged or split or whose breaches changed are named again.
+    changed = np.concatenate([touched, new['record'].to_numpy(dtype='int64'), group,
+                              np.flatnonzero(components != previous)])
+    affected = np.unique(components[changed])
+    kept = index.entities.loc[~np.isin(components[index.entities['component']], affected)]
+    renamed = _name_entities(records, spellings.loc[np.isin(components[spellings['record']], affected)])
+    entities = _insert_entities(records, kept, renamed)
+
+    ids = np.full(len(records), -1, dtype='int64')
+    ids[entities['component'].to_numpy()] = entities.index.to_numpy()
+    split = not np.array_equal(roots[group], previous[group])
+    old_ids = None if split else ids[components[index.entities['component'].to_numpy()]]
+    return EntityIndex(records, spellings, blocks, links, entities), old_ids
+
+
+def entity_labels(index: EntityIndex, names: pd.Series, states: pd.Series) -> pd.DataFrame:
+    """
+    Finds the entity of every breach in an entity index.
+
+    :param index: The index built by build_entity_index() or update_entities(), which has all the names.
+    :param names: The names of the covered entities.
+    :param states: The states of the breaches, with the same index.
+    :return: The 'Entity ID' and the canonical name ('Entity') of every breach, with the same index. Breaches without a
+    name have an id of -1.
+    """
+    rows = pd.DataFrame({'state': states.to_numpy(dtype=object), 'spelling': names.to_numpy(dtype=object)})
+    records = rows.merge(index.spellings[['state', 'spelling', 'record']], how='left', on=['state', 'spelling'])
+    known = records['record'].notna().to_numpy()
+
+    ids = np.full(len(index.records), -1, dtype='int64')
+    ids[index.entities['component'].to_numpy()] = index.entities.index.to_numpy()
+    entity_ids = np.full(len(rows), -1, dtype='int64')
+    entity_ids[known] = ids[index.records['component'].to_numpy()[records.loc[known, 'record'].to_numpy(dtype='int64')]]
+    return entity_columns(index, entity_ids, names.index)
+
+
+def entity_columns(index: EntityIndex, ids: np.ndarray, labels: pd.Index) -> pd.DataFrame:
+    """
+    Names the entities of breaches whose ids are already known.
+
+    :param index: The entity index the ids are from.
+    :param ids: The 'Entity ID' of every breach, or -1 for breaches without a name.
+    :param labels: The index of the breaches.
+    :return: The 'Entity ID' and the canonical name ('Entity') of every breach.
+    """
+    entities = np.append(index.entities['Entity'].to_numpy(dtype=object), None)[ids]
+    return pd.DataFrame({'Entity ID': ids, 'Entity': entities}, index=labels)
+
+
+def _record_name(spelling) -> str:
+    """
+    Normalizes a spelling with normalize_name(). A name that is only legal words, like 'Inc.', is kept in lower case
+    instead, so that it isn't the same name as every other such name.
+
+    :param spelling: The name as it was written.
+    :return: The name of its record.
+    """
+    spelling = str(spelling)
+    return normalize_name(spelling) or spelling.lower().strip()
+
+
+def _count_spellings(names: pd.Series, states: pd.Series) -> pd.DataFrame:
+    """
+    Counts the breaches of every distinct pair of a state and a spelling. Breaches without a name are left out.
+
+    :param names: The names of the covered entities.
+    :param states: The states of the breaches, with the same index.
+    :return: The 'state', 'spelling' and 'count' of every pair.
+    """
+    known = names.notna().to_numpy()
+    pairs = pd.DataFrame({'state': states.to_numpy(dtype=object)[known],
+                          'spelling': names.to_numpy(dtype=object)[known]})
+    return pairs.groupby(['state', 'spelling'], sort=False, dropna=False).size().rename('count').reset_index()
+
+
+def _index_spellings(spellings: pd.DataFrame) -> EntityIndex:
+    """
+    Builds an entity index from the counted spellings (see _count_spellings()).
+
+    :param spellings: The 'state', 'spelling' and 'count' of every distinct pair of a state and a spelling.
+    :return: The entity index.
+    """
+    # Each distinct pair of a state and a normalized name is resolved once, however many breaches it has.
+    codes, uniques = pd.factorize(spellings['spelling'].to_numpy(dtype=object))
+    keys = pd.DataFrame({'state': spellings['state'].to_numpy(dtype=object),
+                         'name': np.array([_record_name(spelling) for spelling in uniques], dtype=object)[codes]})
+    records = keys.drop_duplicates(ignore_index=True)
+    spellings = spellings.reset_index(drop=True).assign(
+        record=keys.merge(records.reset_index(), how='left', on=['state', 'name'])['index'].to_numpy())
+
+    blocks = _blocks(records['state'], records['name'])
+    left, right = _same_names(records, records.index.to_numpy())
+    links = _matches(records, blocks, records.index.to_numpy())
+    components = _components(len(records), np.concatenate([left, links['first'].to_numpy()]),
+                             np.concatenate([right, links['second'].to_numpy()]))
+    records = records.assign(component=components)
+    entities = _number_entities(records, _name_entities(records, spellings))
+    return EntityIndex(records, spellings, blocks, links, entities)
+
+
+def _blocks(states: pd.Series, names: pd.Series) -> pd.DataFrame:
+    """
+    Finds the blocks of records: the state, followed by the first BLOCK_PREFIX letters of a word of the name or of the
+    whole name without spaces, for names that only differ in where the words are split.
+
+    :param states: The state of every record, indexed by the record.
+    :param names: The normalized name of every record, with the same index.
+    :return: The 'record' and 'block' of every distinct pair of a record and one of its blocks.
+    """
+    words = pd.concat([names.str.split().explode().dropna(), names.str.replace(' ', '', regex=False)])
+    words = words.loc[words.str.len() >= BLOCK_PREFIX]
+    blocks = pd.DataFrame({'record': words.index.to_numpy(dtype='int64'),
+                           'block': states.fillna('').loc[words.index].to_numpy(dtype=object) + ' ' +
+                           words.str[:BLOCK_PREFIX].to_numpy(dtype=object)})
+    return blocks.drop_duplicates(ignore_index=True)
+
+
+def _same_names(records: pd.DataFrame, new: np.ndarray) -> tuple:
+    """
+    Links records to the first record with the same normalized name. Those are the same entity, whatever their state.
+    Names that are empty say nothing about the entity, and are left alone.
+
+    :param records: The 'name' of every record.
+    :param new: The records to link.
+    :return: The arrays of the first and second record of every link.
+    """
+    names = records['name']
+    linked = names.loc[new]
+    linked = linked.loc[(linked != '').to_numpy()]
+    first_records = names.loc[names.isin(linked).to_numpy()].reset_index().groupby('name')['index'].min()
+    return first_records.loc[linked].to_numpy(dtype='int64'), linked.index.to_numpy(dtype='int64')
+
+
+def _matches(records: pd.DataFrame, blocks: pd.DataFrame, new: np.ndarray) -> pd.DataFrame:
+    """
+    Scores records against the records they share a block with, if the block has at most MAX_BLOCK_SIZE records, and
+    links the ones whose names are at least MATCH_THRESHOLD alike.
+
+    :param records: The 'name' of every record.
+    :param blocks: The blocks of every record (see _blocks()).
+    :param new: The records to score.
+    :return: The 'first' and 'second' record of every link, with the first one smaller.
+    """
+    shared = blocks.loc[blocks['block'].isin(blocks.loc[blocks['record'].isin(new), 'block'])]
+    shared = shared.loc[shared.groupby('block')['record'].transform('size').between(2, MAX_BLOCK_SIZE).to_numpy()]
+    pairs = shared.loc[shared['record'].isin(new)].merge(shared, on='block', suffixes=('_first', '_second'))
+    first, second = pairs['record_first'].to_numpy(), pairs['record_second'].to_numpy()
+    # Two new records in the same block are paired from both sides, and only scored once.
+    pairs = pd.DataFrame({'first': np.minimum(first, second), 'second': np.maximum(first, second)}, dtype='int64')
+    pairs = pairs.loc[(pairs['first'] != pairs['second']).to_numpy()].drop_duplicates(ignore_index=True)
+
+    names = records['name'].loc[np.union1d(pairs['first'], pairs['second'])]
+    trigrams = {record: _trigrams(name) for record, name in names.items()}
+    scores = np.array([_jaccard(trigrams[i], trigrams[j]) for i, j in zip(pairs['first'], pairs['second'])],
+                      dtype='float64')
+    return pairs.loc[scores >= MATCH_THRESHOLD].reset_index(drop=True)
+
+
+def _supported(links: pd.DataFrame, blocks: pd.DataFrame) -> np.ndarray:
+    """
+    Finds the links whose records still share a block that is scored, with at most MAX_BLOCK_SIZE records.
+
+    :param links: The 'first' and 'second' record of every link.
+    :param blocks: The blocks of every record (see _blocks()).
+    :return: Whether each link is still supported.
+    """
+    shared = links.reset_index().merge(blocks.rename(columns={'record': 'first'}), on='first')
+    shared = shared.merge(blocks.rename(columns={'record': 'second'}), on=['second', 'block'])
+    sizes = blocks.loc[blocks['block'].isin(shared['block']), 'block'].value_counts()
+    scored = sizes.loc[shared['block']].between(2, MAX_BLOCK_SIZE).to_numpy()
+    return links.index.isin(shared.loc[scored, 'index'])
+
+
+def _name_entities(records: pd.DataFrame, spellings: pd.DataFrame) -> pd.DataFrame:
+    """
+    Names entities after the spelling that most of their breaches use, or the first one alphabetically.
+
+    :param records: The 'component' of every record.
+    :param spellings: All the spellings of the entities to name, with their 'record' and 'count'.
+    :return: The 'component' and canonical name ('Entity') of every entity.
+    """
+    spelling = pd.DataFrame({'component': records['component'].to_numpy()[spellings['record'].to_numpy(dtype='int64')],
+                             'spelling': spellings['spelling'].to_numpy(dtype=object),
+                             'count': spellings['count'].to_numpy()})
+    counts = spelling.groupby(['component', 'spelling'])['count'].sum().reset_index()
+    counts = counts.sort_values(['component', 'count', 'spelling'], ascending=[True, False, True], kind='mergesort')
+    return counts.drop_duplicates('component')[['component', 'spelling']].rename(columns={'spelling': 'Entity'})
+
+
+def _insert_entities(records: pd.DataFrame, kept: pd.DataFrame, renamed: pd.DataFrame) -> pd.DataFrame:
+    """
+    Numbers entities like _number_entities() does, when most of them are already in order. Only the entities that were
+    named again are sorted, and they are put in place with a binary search on the names of the others.
+
+    :param records: The 'state' and 'name' of every record.
+    :param kept: The entities that are already in order.
+    :param renamed: The 'component' and 'Entity' of the entities that were named again.
+    :return: All the entities, indexed by their 'Entity ID'.
+    """
+    renamed = _number_entities(records, renamed)
+    names, renamed_names = kept['Entity'].to_numpy(dtype=object), renamed['Entity'].to_numpy(dtype=object)
+    positions = np.searchsorted(names, renamed_names)
+    # Entities that have the same name as another one are ordered by their records, so they are all sorted again.
+    if renamed['Entity'].duplicated().any() or (np.searchsorted(names, renamed_names, side='right') != positions).any():
+        return _number_entities(records, pd.concat([kept, renamed], ignore_index=True))
+    order = np.insert(np.arange(len(kept)), positions, len(kept) + np.arange(len(renamed)))
+    return pd.concat([kept, renamed], ignore_index=True).iloc[order].reset_index(drop=True).rename_axis('Entity ID')
+
+
+def _number_entities(records: pd.DataFrame, entities: pd.DataFrame) -> pd.DataFrame:
+    """
+    Gives entities their ids, in the alphabetical order of their names. Entities with the same name are ordered by the
+    state and name of their first record.
+
+    :param records: The 'state' and 'name' of every record.
+    :param entities: The 'component' and 'Entity' of every entity.
+    :return: The entities, indexed by their 'Entity ID'.
+    """
+    first = records.loc[entities['component'].to_numpy()]
+    order = pd.DataFrame({'Entity': entities['Entity'].to_numpy(dtype=object),
+                          'state': first['state'].to_numpy(dtype=object), 'name': first['name'].to_numpy(dtype=object)})
+    order = order.sort_values(['Entity', 'state', 'name'], kind='mergesort').index.to_numpy()
+    return entities.iloc[order].reset_index(drop=True).rename_axis('Entity ID')
+
+
+def _components(size: int, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """
+    Finds the groups of records that are linked by a chain of pairs. Every record starts with its own label, and each
+    pass gives both records of every pair the smaller of their labels and then follows the labels to their own labels,
+    until no label changes.
+
+    :param size: The number of records.
+    :param left: The first record of every pair.
+    :param right: The second record of every pair.
+    :return: The label of every record: the smallest record of its group.
+    """
+    labels = np.arange(size)
+    while True:
+        smaller = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, smaller)
+        np.minimum.at(updated, right, smaller)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def _trigrams(name: str) -> set:
+    """
+    Returns the sequences of three characters in a name. The spaces are taken out first, so that 'wal mart' and
+    'walmart' are the same. A name shorter than three characters is its own only sequence.
+
+    :param name: The normalized name.
+    :return: The trigrams.
+    """
+    letters = name.replace(' ', '')
+    return {letters[i:i + 3] for i in range(len(letters) - 2)} or {letters}
+
+
+def _jaccard(first: set, second: set) -> float:
+    """
+    Divides the number of items two sets share by the number of items in either of them.
+
+    :param first: A set.
+    :param second: The other set.
+    :return: The ratio, or 0 if both sets are empty.
+    """
+    union = len(first | second)
+    return len(first & second) / union if union else 0.0
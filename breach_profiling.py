@@ -0,0 +1,177 @@
+import json
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+
+# The profile that is recording at the moment, or None when profiling is turned off.
+_active = None
+
+
+def stage(function):
+    """
+    Marks a function as a stage of the pipeline. While a profile is recording (see profile()), every call of the
+    function is timed and added to it. When no profile is recording, the function is called straight away, so the only
+    cost is checking whether one is.
+
+    :param function: The function to mark.
+    :return: The marked function.
+
+    >>> @stage
+    ... def double(df):
+    ...     return df * 2
+    >>> with profile() as profiler:
+    ...     result = double([1, 2])
+    >>> [(record['stage'], record['rows_in'], record['rows_out']) for record in profiler.records]
+    [('double', 2, 4)]
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _active is None:
+            return function(*args, **kwargs)
+        return _active.run(function, args, kwargs)
+
+    return wrapper
+
+
+class Profile:
+    """
+    The measurements of every stage that ran while profile() was recording. Each record has the name of the stage, the
+    stages it was called from (its path), when it started, how long it took in total and outside of the stages it
+    called, the number of rows it was given and returned, and, if memory is measured, the peak memory it allocated on
+    top of what was already in use.
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.records = []
+        self._stack = []
+        self._start = time.perf_counter()
+
+    def run(self, function, args: tuple, kwargs: dict):
+        """
+        Runs a stage and records its measurements.
+
+        :param function: The function of the stage.
+        :param args: The positional arguments of the function.
+        :param kwargs: The keyword arguments of the function.
+        :return: Whatever the function returns.
+        """
+        frame = {'stage': function.__name__, 'memory': 0, 'peak': 0, 'children': 0.0}
+        if self.memory:
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            frame['memory'] = frame['peak'] = tracemalloc.get_traced_memory()[0]
+
+        self._stack.append(frame)
+        start_time = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start_time
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['children'] += seconds
+
+        record = {'stage': frame['stage'], 'path': ';'.join([parent['stage'] for parent in self._stack] +
+                                                            [frame['stage']]),
+                  'start': round(start_time - self._start, 6), 'seconds': round(seconds, 6),
+                  'self_seconds': round(max(0.0, seconds - frame['children']), 6),
+                  'rows_in': _rows(args[0]) if args else None, 'rows_out': _rows(result)}
+        if self.memory:
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = round((peak - frame['memory']) / 2 ** 20, 3)
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+        self.records.append(record)
+
+        return result
+
+    def summary(self) -> list:
+        """
+        Adds up the records of every stage: how many times it ran, its total time, the time spent in the stage itself
+        rather than in the stages it called, and its largest peak memory.
+
+        :return: One dictionary for every stage, the slowest first.
+        """
+        stages = {}
+        for record in self.records:
+            total = stages.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'seconds': 0.0,
+                                                        'self_seconds': 0.0, 'peak_mb': None})
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            total['self_seconds'] += record['self_seconds']
+            if 'peak_mb' in record:
+                total['peak_mb'] = max(total['peak_mb'] or 0.0, record['peak_mb'])
+
+        for total in stages.values():
+            total['seconds'] = round(total['seconds'], 6)
+            total['self_seconds'] = round(total['self_seconds'], 6)
+        return sorted(stages.values(), key=lambda total: total['seconds'], reverse=True)
+
+    def folded(self) -> str:
+        """
+        Returns the time spent in every path of stages in the 'folded stacks' format that flame graph tools read: one
+        line per path, with the stages separated by semicolons and followed by the microseconds spent in the last one.
+
+        :return: The folded stacks.
+        """
+        paths = {}
+        for record in self.records:
+            paths[record['path']] = paths.get(record['path'], 0) + record['self_seconds']
+        return ''.join('{} {}\n'.format(path, round(seconds * 1e6)) for path, seconds in paths.items())
+
+    def to_json(self, path: str) -> None:
+        """
+        Writes the records and the summary to a JSON file.
+
+        :param path: The path of the file.
+        :return: No return value.
+        """
+        with open(path, 'w') as file:
+            json.dump({'records': self.records, 'summary': self.summary()}, file, indent=2)
+
+
+@contextmanager
+def profile(memory: bool = False):
+    """
+    Records every stage of the pipeline that runs inside the 'with' block. Measuring memory uses tracemalloc, which
+    makes the stages slower, so it is only done when asked for. Stages that run in other processes, like the ones
+    render_report() starts, are not recorded.
+
+    :param memory: Whether to measure the peak memory of every stage.
+    :return: The profile, which holds the records once the block ends.
+    """
+    global _active
+    previous = _active
+    _active = Profile(memory)
+
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield _active
+    finally:
+        if started:
+            tracemalloc.stop()
+        _active = previous
+
+
+def _rows(value):
+    """
+    Returns the number of rows of a dataframe, series, list or prepared dataset, or of the first item of a tuple.
+
+    :param value: The value.
+    :return: The number of rows, or None if the value doesn't have any.
+    """
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    if hasattr(value, 'data') and hasattr(value.data, 'shape'):
+        value = value.data
+    if hasattr(value, 'shape'):
+        return int(value.shape[0])
+    if isinstance(value, list):
+        return len(value)
+    return None
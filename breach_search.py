@@ -0,0 +1,312 @@
+import re
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+
+from breach_profiling import stage
+
+
+# The words of a description are its runs of letters and digits, in lower case, so 'e-PHI' is the two words 'e' and
+# 'phi', and the phrase "e-PHI" finds it.
+TOKEN_PATTERN = r'[a-z0-9]+'
+
+# The words with a special meaning in a query. They are only operators when they are written in capitals.
+QUERY_OPERATORS = ('AND', 'OR', 'NOT')
+
+# Positions are packed next to the row in a single integer when phrases are matched, see _phrase_rows().
+_POSITION_BITS = 32
+
+
+@dataclass
+class SearchIndex:
+    """
+    An inverted index of the descriptions of the breaches, built by build_index(). Instead of going through every
+    description, a query looks up the rows each of its words occurs in (their posting lists), and combines them.
+
+    terms: Every distinct word, sorted.
+    postings: One row for every occurrence of a word: the position of the word in terms ('term'), the index label of
+    the breach ('row') and the number of words before it in the description ('position'). Sorted by all three.
+    rows: The index labels of every breach in the index, sorted. NOT is taken relative to these.
+    """
+    terms: np.ndarray
+    postings: pd.DataFrame
+    rows: np.ndarray
+
+
+def tokenize(text: str) -> list:
+    """
+    Splits a text into the words the index is built from.
+
+    :param text: The text.
+    :return: The words, in lower case.
+
+    >>> tokenize('Unencrypted laptop stolen; e-PHI of 1,272 individuals.')
+    ['unencrypted', 'laptop', 'stolen', 'e', 'phi', 'of', '1', '272', 'individuals']
+    """
+    return re.findall(TOKEN_PATTERN, text.lower())
+
+
+@stage
+def build_index(texts: pd.Series) -> SearchIndex:
+    """
+    This function builds the inverted index of the descriptions. Every description is split into words with the same
+    rules as tokenize(), and the position of every word is kept so that phrases can be found. Missing descriptions are
+    left out of the index.
+
+    :param texts: The descriptions, indexed by the index labels of the breaches.
+    :return: The index.
+
+    >>> index = build_index(pd.Series(['Laptop stolen', 'Unencrypted laptop lost', None], index=[10, 11, 12]))
+    >>> index.terms.tolist()
+    ['laptop', 'lost', 'stolen', 'unencrypted']
+    >>> index.rows.tolist()
+    [10, 11]
+    """
+    texts = texts.dropna()
+    words = texts.astype(str).str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+
+    codes, terms = pd.factorize(words, sort=True)
+    postings = pd.DataFrame({'term': codes.astype('int32'), 'row': words.index.to_numpy(dtype='int64'),
+                             'position': words.groupby(level=0).cumcount().to_numpy(dtype='int32')})
+
+    return SearchIndex(np.asarray(terms, dtype=object), _sort_postings(postings),
+                       np.sort(texts.index.to_numpy(dtype='int64')))
+
+
+@stage
+def update_index(index: SearchIndex, texts: pd.Series, removed: list = ()) -> SearchIndex:
+    """
+    Adds the descriptions of new breaches to an index and takes the removed breaches out of it. Only the new
+    descriptions are split into words and sorted; their postings are then inserted into the sorted postings of the
+    index where they belong, so the index is never sorted again. The codes of the old postings only change when there
+    are new words, and then they are all moved with a single lookup.
+
+    :param index: The index built by build_index().
+    :param texts: The descriptions of the new breaches.
+    :param removed: The index labels of the breaches to take out.
+    :return: The updated index.
+
+    >>> index = build_index(pd.Series(['Laptop stolen', 'Paper records lost'], index=[0, 1]))
+    >>> index = update_index(index, pd.Series(['Laptop lost'], index=[2]), removed=[0])
+    >>> search(index, 'laptop').tolist()
+    [2]
+    >>> search(index, 'lost').tolist()
+    [1, 2]
+    >>> index.postings.equals(build_index(pd.Series(['Paper records lost', 'Laptop lost'], index=[1, 2])).postings)
+    True
+    """
+    added = build_index(texts)
+    term, row, position = (index.postings[column].to_numpy() for column in ['term', 'row', 'position'])
+    if len(removed):
+        kept = ~index.postings['row'].isin(removed).to_numpy()
+        term, row, position = term[kept], row[kept], position[kept]
+
+    # The codes of both indexes are moved to the positions of their words in the merged list of words.
+    terms = np.union1d(index.terms.astype(str), added.terms.astype(str)).astype(object)
+    if len(terms) > len(index.terms):
+        term = terms.searchsorted(index.terms).astype('int32')[term]
+    new_term = terms.searchsorted(added.terms).astype('int32')[added.postings['term'].to_numpy()]
+    new_row, new_position = added.postings['row'].to_numpy(), added.postings['position'].to_numpy()
+
+    # Every new posting goes into the postings of its word, before the first one with a larger row and position.
+    at = term.searchsorted(new_term, side='left')
+    ends = term.searchsorted(new_term, side='right')
+    packed = (new_row << _POSITION_BITS) + new_position
+    bounds = np.flatnonzero(np.diff(new_term, prepend=-1, append=-1))
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        start, end = at[first], ends[first]
+        block = (row[start:end] << _POSITION_BITS) + position[start:end]
+        at[first:last] = start + block.searchsorted(packed[first:last])
+
+    postings = pd.DataFrame({'term': np.insert(term, at, new_term), 'row': np.insert(row, at, new_row),
+                             'position': np.insert(position, at, new_position)})
+    rows = np.union1d(np.setdiff1d(index.rows, np.asarray(removed, dtype='int64')), added.rows)
+
+    return SearchIndex(terms, postings, rows)
+
+
+def select_rows(index: SearchIndex, rows: list) -> SearchIndex:
+    """
+    Returns the part of an index that covers some of its breaches.
+
+    :param index: The index.
+    :param rows: The index labels of the breaches to keep.
+    :return: The smaller index. It has the same terms as the original one.
+    """
+    postings = index.postings.loc[index.postings['row'].isin(rows)].reset_index(drop=True)
+    return SearchIndex(index.terms, postings, np.intersect1d(index.rows, np.asarray(rows, dtype='int64')))
+
+
+@stage
+def search(index: SearchIndex, query: str) -> pd.Index:
+    """
+    This function finds the breaches whose descriptions match a query. A query is made of words, which are matched
+    regardless of case, and phrases in double quotes, whose words have to occur right after each other. A word ending
+    in '*' matches every word that starts with it. They are combined with AND, OR and NOT (in capitals) and
+    parentheses; NOT binds tighter than AND, which binds tighter than OR, and two terms with no operator between them
+    are joined by AND.
+
+    :param index: The index built by build_index().
+    :param query: The query.
+    :return: The sorted index labels of the matching breaches.
+
+    >>> index = build_index(pd.Series(['Unencrypted laptop stolen from a car', 'Laptop was encrypted', 'Phishing e-mail', 'Paper records stolen'], index=[0, 1, 2, 3]))
+    >>> search(index, 'laptop').tolist()
+    [0, 1]
+    >>> search(index, '"unencrypted laptop"').tolist()
+    [0]
+    >>> search(index, 'stolen AND NOT laptop').tolist()
+    [3]
+    >>> search(index, '(phishing OR paper) stolen').tolist()
+    [3]
+    >>> search(index, 'encrypt* OR e-mail').tolist()
+    [1, 2]
+    >>> search(index, 'laptop AND')
+    Traceback (most recent call last):
+    ...
+    ValueError: The query 'laptop AND' ends too early.
+    """
+    tokens = re.findall(r'"[^"]*"|\(|\)|[^\s()"]+', query)
+    parser = _QueryParser(tokens, query)
+    tree = parser.parse()
+    return pd.Index(_evaluate(index, tree), dtype='int64')
+
+
+class _QueryParser:
+    """
+    Turns the tokens of a query into a tree of ('or', left, right), ('and', left, right), ('not', operand) and
+    ('phrase', words, prefix) nodes, where a single word is a phrase of one word.
+    """
+
+    def __init__(self, tokens: list, query: str):
+        self.tokens = tokens
+        self.query = query
+        self.position = 0
+
+    def parse(self) -> tuple:
+        """
+        Parses the whole query.
+
+        :return: The tree of the query.
+        """
+        if not self.tokens:
+            raise ValueError("The query {!r} is empty.".format(self.query))
+        tree = self._or()
+        if self.position < len(self.tokens):
+            raise ValueError("The query {!r} has an unexpected {!r}.".format(self.query, self.tokens[self.position]))
+        return tree
+
+    def _peek(self) -> str:
+        """Returns the next token, or None at the end of the query."""
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _or(self) -> tuple:
+        """Parses terms joined by OR."""
+        tree = self._and()
+        while self._peek() == 'OR':
+            self.position += 1
+            tree = ('or', tree, self._and())
+        return tree
+
+    def _and(self) -> tuple:
+        """Parses terms joined by AND, or by nothing at all."""
+        tree = self._not()
+        while self._peek() is not None and self._peek() not in ('OR', ')'):
+            if self._peek() == 'AND':
+                self.position += 1
+            tree = ('and', tree, self._not())
+        return tree
+
+    def _not(self) -> tuple:
+        """Parses a term that may be negated with NOT."""
+        if self._peek() == 'NOT':
+            self.position += 1
+            return 'not', self._not()
+        return self._term()
+
+    def _term(self) -> tuple:
+        """Parses a word, a phrase or a query in parentheses."""
+        token = self._peek()
+        if token is None:
+            raise ValueError("The query {!r} ends too early.".format(self.query))
+        if token in QUERY_OPERATORS or token == ')':
+            raise ValueError("The query {!r} has an unexpected {!r}.".format(self.query, token))
+        self.position += 1
+
+        if token == '(':
+            tree = self._or()
+            if self._peek() != ')':
+                raise ValueError("The query {!r} is missing a ')'.".format(self.query))
+            self.position += 1
+            return tree
+
+        prefix = token.endswith('*') and not token.startswith('"')
+        words = tokenize(token.strip('"'))
+        if not words:
+            raise ValueError("The query {!r} has a term without any words: {!r}.".format(self.query, token))
+        return 'phrase', tuple(words), prefix
+
+
+def _evaluate(index: SearchIndex, tree: tuple) -> np.ndarray:
+    """
+    Finds the rows that match a parsed query.
+
+    :param index: The index.
+    :param tree: The query, as parsed by _QueryParser.
+    :return: The sorted index labels of the matching rows.
+    """
+    if tree[0] == 'or':
+        return np.union1d(_evaluate(index, tree[1]), _evaluate(index, tree[2]))
+    if tree[0] == 'and':
+        return np.intersect1d(_evaluate(index, tree[1]), _evaluate(index, tree[2]), assume_unique=True)
+    if tree[0] == 'not':
+        return np.setdiff1d(index.rows, _evaluate(index, tree[1]), assume_unique=True)
+    return _phrase_rows(index, tree[1], tree[2])
+
+
+def _postings(index: SearchIndex, word: str, prefix: bool = False) -> pd.DataFrame:
+    """
+    Returns the posting list of a word, found by a binary search in the sorted words and postings.
+
+    :param index: The index.
+    :param word: The word.
+    :param prefix: Whether to return the postings of every word that starts with it instead.
+    :return: The postings, with the 'row' and 'position' of every occurrence.
+    """
+    first = index.terms.searchsorted(word, side='left')
+    last = index.terms.searchsorted(word + '\uffff', side='left') if prefix else \
+        index.terms.searchsorted(word, side='right')
+
+    codes = index.postings['term'].to_numpy()
+    start, end = codes.searchsorted(first, side='left'), codes.searchsorted(last, side='left')
+    return index.postings.iloc[start:end]
+
+
+def _phrase_rows(index: SearchIndex, words: tuple, prefix: bool) -> np.ndarray:
+    """
+    Finds the rows in which the words occur one right after the other. The occurrences of the first word are the
+    candidates, and each following word keeps only those that it occurs the right number of positions after. Only the
+    last word of a phrase can be a prefix.
+
+    :param index: The index.
+    :param words: The words of the phrase.
+    :param prefix: Whether the last word is a prefix.
+    :return: The sorted index labels of the matching rows.
+    """
+    candidates = None
+    for offset, word in enumerate(words):
+        postings = _postings(index, word, prefix and offset == len(words) - 1)
+        starts = (postings['row'].to_numpy() << _POSITION_BITS) + postings['position'].to_numpy() - offset
+        candidates = starts if candidates is None else np.intersect1d(candidates, starts)
+
+    return np.unique(candidates >> _POSITION_BITS)
+
+
+def _sort_postings(postings: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sorts postings by word, row and position, which _postings() and _phrase_rows() depend on.
+
+    :param postings: The postings.
+    :return: The sorted postings.
+    """
+    return postings.sort_values(['term', 'row', 'position'], kind='mergesort').reset_index(drop=True)
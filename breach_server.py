@@ -0,0 +1,462 @@
+import pandas as pd
+import json
+import time
+import asyncio
+import argparse
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qsl
+
+import IS597PR_Final_Project as breaches
+from breach_profiling import stage
+
+
+# The server only listens on this machine by default, since it has no authentication.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8597
+
+# The number of query results kept in memory.
+DEFAULT_CACHE_SIZE = 256
+
+# The parameters every kind of query accepts, with their default values. A parameter without a default is required.
+QUERY_PARAMETERS = {
+    '/aggregate': {'column': None, 'end': '2013-09-22', 'start': '2009-01-01'},
+    '/top': {'group': None, 'cause': None, 'k': '1', 'end': '2013-09-22', 'start': '2009-01-01'},
+}
+
+# The columns a query can group by besides those of the data. 'Month' groups by the year and the month.
+DATE_COLUMNS = {'Year': ['Year'], 'Month': ['Year', 'Month']}
+
+# The largest request line and headers the server reads, so a client can't make it buffer without limit.
+MAX_REQUEST_BYTES = 16384
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class QueryError(ValueError):
+    """
+    A query that can't be answered because of its parameters. Only these errors are the client's fault; any other error
+    while answering a query is the server's.
+    """
+
+
+class QueryCache:
+    """
+    A cache of the most recently used query results. When it is full, the result that was used the longest time ago is
+    dropped to make room for a new one.
+
+    >>> cache = QueryCache(2)
+    >>> cache.put('a', 1); cache.put('b', 2); cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None, cache.get('a'), cache.get('c')
+    (True, 1, 3)
+    >>> cache.stats()
+    {'size': 2, 'capacity': 2, 'hits': 3, 'misses': 1}
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the result of a query and marks it as the most recently used one.
+
+        :param key: The normalized query.
+        :return: The result, or None if it isn't in the cache.
+        """
+        if key not in self._results:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._results.move_to_end(key)
+        return self._results[key]
+
+    def put(self, key, result) -> None:
+        """
+        Adds the result of a query, dropping the least recently used one if the cache is full.
+
+        :param key: The normalized query.
+        :param result: The result.
+        :return: No return value.
+        """
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.capacity:
+            self._results.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drops every result, for when the data they were computed from changes.
+
+        :return: No return value.
+        """
+        self._results.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the number of results in the cache, its capacity, and how many lookups found a result or didn't.
+
+        :return: The statistics.
+        """
+        return {'size': len(self._results), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses}
+
+
+def normalize_query(path: str, parameters: dict) -> tuple:
+    """
+    Checks the parameters of a query, fills in the defaults and writes them in a single way, so that queries asking for
+    the same thing have the same key in the cache: the dates are written as YYYY-MM-DD and k as a number.
+
+    :param path: The kind of query, one of QUERY_PARAMETERS.
+    :param parameters: The parameters of the query string.
+    :return: The path followed by the sorted (name, value) pairs.
+
+    >>> normalize_query('/top', {'group': 'State', 'cause': 'Type of Breach', 'start': '2012-1-1', 'end': '2012/12/31'})
+    ('/top', ('cause', 'Type of Breach'), ('end', '2012-12-31'), ('group', 'State'), ('k', 1), ('start', '2012-01-01'))
+    >>> normalize_query('/aggregate', {'column': 'State', 'limit': '5'})
+    Traceback (most recent call last):
+    ...
+    breach_server.QueryError: Unknown parameter 'limit' for /aggregate.
+    >>> normalize_query('/top', {'group': 'State', 'cause': 'State'})
+    Traceback (most recent call last):
+    ...
+    breach_server.QueryError: The causes can't be counted within the groups of the same column, 'State'.
+    """
+    if path not in QUERY_PARAMETERS:
+        raise QueryError("There is no query {}.".format(path))
+    accepted = QUERY_PARAMETERS[path]
+
+    for name in parameters:
+        if name not in accepted:
+            raise QueryError("Unknown parameter {!r} for {}.".format(name, path))
+
+    query = {}
+    for name, default in accepted.items():
+        value = parameters.get(name, default)
+        if value is None:
+            raise QueryError("The parameter {!r} is required for {}.".format(name, path))
+        query[name] = value
+    if path == '/top' and query['group'] == query['cause']:
+        raise QueryError("The causes can't be counted within the groups of the same column, {!r}.".format(
+            query['cause']))
+
+    for name in ('start', 'end'):
+        try:
+            query[name] = pd.Timestamp(query[name]).strftime('%Y-%m-%d')
+        except ValueError:
+            raise QueryError("{!r} is not a date.".format(query[name])) from None
+    if 'k' in query:
+        if not str(query['k']).isdigit() or int(query['k']) < 1:
+            raise QueryError("k has to be a positive whole number, not {!r}.".format(query['k']))
+        query['k'] = int(query['k'])
+
+    return (path,) + tuple(sorted(query.items()))
+
+
+@stage
+def run_query(dataset: breaches.PreparedDataset, query: tuple) -> bytes:
+    """
+    This function answers a normalized query from the prepared dataset with the analysis functions, and encodes the
+    answer as JSON. '/aggregate' returns the number of breaches and the sums of the numeric columns for every value of
+    a column, from the cube when it can (see aggregate_dataset()); '/top' returns the top k causes in every group, like
+    multi_column_table().
+
+    :param dataset: The prepared dataset.
+    :param query: The query, as returned by normalize_query().
+    :return: The body of the response.
+    """
+    path, parameters = query[0], dict(query[1:])
+    end, start = parameters['end'], parameters['start']
+
+    if path == '/aggregate':
+        column = parameters['column']
+        columns = DATE_COLUMNS[column] if column in DATE_COLUMNS else [_check_column(dataset, column)]
+        table = breaches.aggregate_dataset(dataset, columns, end, start)
+    else:
+        table = breaches.multi_column_table(dataset, _check_column(dataset, parameters['group']),
+                                            _check_column(dataset, parameters['cause']), end, start, parameters['k'])
+
+    rows = json.loads(table.reset_index().to_json(orient='records', date_format='iso'))
+    return json.dumps({'query': parameters, 'key': dataset.key, 'rows': rows}).encode('utf-8')
+
+
+@lru_cache(maxsize=4096)
+def _parse_query(path: str, query_string: str) -> tuple:
+    """
+    Normalizes the query string of a request with normalize_query(). A dashboard sends the same query strings again and
+    again, so the normalized form of each one is remembered and its dates are only parsed the first time.
+
+    :param path: The kind of query.
+    :param query_string: The query string.
+    :return: The normalized query.
+    """
+    return normalize_query(path, dict(parse_qsl(query_string)))
+
+
+def _check_column(dataset: breaches.PreparedDataset, column: str) -> str:
+    """
+    Makes sure a query only groups by a column the dataset has. The date of submission and the measures that are added
+    up, like 'Individuals Affected', can't be grouped by.
+
+    :param dataset: The prepared dataset.
+    :param column: The name of the column.
+    :return: The name of the column.
+    """
+    if column not in dataset.data.columns or column == 'Breach Submission Date':
+        raise QueryError("{!r} is not a column of the data.".format(column))
+    if column in breaches.AGGREGATE_SUMS or column == 'Breaches':
+        raise QueryError("{!r} is a measure, which can't be grouped by.".format(column))
+    return column
+
+
+class BreachServer:
+    """
+    Answers aggregate queries about a breach report over HTTP. The report is loaded and cleaned once, with
+    load_dataset(), and every query is then answered from memory. The answers are kept in a QueryCache, so a query that
+    was asked before is answered without running the analysis again. When the report is loaded again, because the file
+    changed or because /reload was asked for, the cache is cleared.
+
+    The queries are GET requests, for example /aggregate?column=Type%20of%20Breach&start=2012-01-01&end=2012-12-31 or
+    /top?group=State&cause=Location%20of%20Breach&k=3. GET /status describes the dataset and the cache, and POST
+    /reload loads the report again. Answers are computed in a thread, so the server keeps accepting requests meanwhile,
+    and identical queries that arrive while one is being computed wait for its answer instead of computing it again.
+    """
+
+    def __init__(self, path: str, cache_size: int = DEFAULT_CACHE_SIZE, incremental: bool = False):
+        self.path = path
+        self.incremental = incremental
+        self.cache = QueryCache(cache_size)
+        self.dataset = None
+        self._file_state = None
+        self._pending = {}
+        self._reloading = None
+
+    def load(self) -> None:
+        """
+        Loads the report, with update_dataset() if the server is incremental and load_dataset() otherwise, and clears
+        the cache if the data changed.
+
+        :return: No return value.
+        """
+        file_state = self._stat()
+        dataset = breaches.update_dataset(self.path) if self.incremental else breaches.load_dataset(self.path)
+
+        if self.dataset is None or dataset.key != self.dataset.key:
+            self.cache.clear()
+        self.dataset, self._file_state = dataset, file_state
+
+    async def reload(self) -> None:
+        """
+        Loads the report again in a thread. Queries keep being answered from the old data until the new one is ready,
+        or if it can't be loaded, and only one reload runs at a time.
+
+        :return: No return value.
+        """
+        if self._reloading is None:
+            self._reloading = asyncio.get_running_loop().run_in_executor(None, self.load)
+        try:
+            await asyncio.shield(self._reloading)
+        finally:
+            self._reloading = None
+
+    async def watch(self, interval: float) -> None:
+        """
+        Reloads the report whenever its size or modification time changes, checking every few seconds.
+
+        :param interval: The number of seconds between the checks.
+        :return: No return value. It runs until it is cancelled.
+        """
+        file_state = failed = None
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                file_state = self._stat()
+                if file_state not in (self._file_state, failed):
+                    await self.reload()
+            except Exception as error:
+                # The old data keeps being served, and the file isn't read again until it changes once more.
+                failed = file_state
+                print("Could not reload {}: {}".format(self.path, error))
+
+    async def answer(self, path: str, query_string: str) -> bytes:
+        """
+        Answers a query from the cache, or computes the answer in a thread and caches it.
+
+        :param path: The kind of query.
+        :param query_string: The query string of the request, like 'column=State&start=2012-01-01'.
+        :return: The body of the response.
+        """
+        key = (self.dataset.key,) + _parse_query(path, query_string)
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+
+        if key not in self._pending:
+            self._pending[key] = asyncio.get_running_loop().run_in_executor(None, run_query, self.dataset, key[1:])
+        future = self._pending[key]
+        try:
+            body = await asyncio.shield(future)
+        finally:
+            self._pending.pop(key, None)
+
+        # The data may have been reloaded while the answer was computed, in which case it is not cached.
+        if key[0] == self.dataset.key:
+            self.cache.put(key, body)
+        return body
+
+    def status(self) -> bytes:
+        """
+        Describes the loaded dataset and the cache.
+
+        :return: The body of the response.
+        """
+        return json.dumps({'file': self.path, 'key': self.dataset.key, 'rows': len(self.dataset.data),
+                           'cache': self.cache.stats()}).encode('utf-8')
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves the requests of a connection. The connection is kept open for more requests unless the client asks to
+        close it.
+
+        :param reader: The stream the requests are read from.
+        :param writer: The stream the responses are written to.
+        :return: No return value.
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                headers = dict(line.lower().split(':', 1) for line in lines[1:] if ':' in line)
+                keep_alive = headers.get('connection', '').strip() != 'close'
+                length = int(headers.get('content-length', '0').strip() or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                status, body = await self._respond(lines[0])
+                writer.write(_response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def _respond(self, request_line: str) -> tuple:
+        """
+        Works out the response to a request.
+
+        :param request_line: The first line of the request, like 'GET /status HTTP/1.1'.
+        :return: The status code and the body of the response.
+        """
+        try:
+            method, target, _ = request_line.split(' ')
+        except ValueError:
+            return 400, _error("The request line {!r} is not valid.".format(request_line))
+
+        url = urlsplit(target)
+        if url.path == '/reload':
+            if method != 'POST':
+                return 405, _error("/reload only accepts POST.")
+            try:
+                await self.reload()
+            except Exception as error:
+                return 500, _error("Could not reload {}: {}".format(self.path, error))
+            return 200, self.status()
+        if method != 'GET':
+            return 405, _error("{} only accepts GET.".format(url.path))
+        if url.path == '/status':
+            return 200, self.status()
+        if url.path not in QUERY_PARAMETERS:
+            return 404, _error("There is no query {}.".format(url.path))
+
+        try:
+            return 200, await self.answer(url.path, url.query)
+        except QueryError as error:
+            return 400, _error(str(error))
+        except Exception as error:
+            return 500, _error("The query failed: {!r}".format(error))
+
+    def _stat(self) -> tuple:
+        """
+        Returns the size and modification time of the report, which tell whether it changed.
+
+        :return: The size and the modification time in nanoseconds.
+        """
+        stat = breaches.file_stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+
+def _response(status: int, body: bytes, keep_alive: bool = True) -> bytes:
+    """
+    Builds an HTTP response with a JSON body.
+
+    :param status: The status code.
+    :param body: The body.
+    :param keep_alive: Whether the connection stays open afterwards.
+    :return: The response.
+    """
+    head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+        status, STATUS_TEXT[status], len(body), 'keep-alive' if keep_alive else 'close')
+    return head.encode('latin-1') + body
+
+
+def _error(message: str) -> bytes:
+    """
+    Builds the body of an error response.
+
+    :param message: What went wrong.
+    :return: The body.
+    """
+    return json.dumps({'error': message}).encode('utf-8')
+
+
+async def serve(server: BreachServer, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                watch: float = None) -> None:
+    """
+    Loads the report and answers queries until the process is stopped.
+
+    :param server: The server.
+    :param host: The address to listen on.
+    :param port: The port to listen on.
+    :param watch: If it is given, the report is checked for changes every this many seconds.
+    :return: No return value.
+    """
+    start_time = time.perf_counter()
+    await server.reload()
+    print("Loaded {} breaches from {} in {} seconds.".format(len(server.dataset.data), server.path,
+                                                            round(time.perf_counter() - start_time, 3)))
+
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_REQUEST_BYTES)
+    watcher = asyncio.create_task(server.watch(watch)) if watch else None
+    print("Serving on http://{}:{}".format(host, port))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Answer aggregate queries about the breach report over HTTP.')
+    parser.add_argument('--file', default='breach_report.csv', help='The breach report to serve.')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='The address to listen on.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='The port to listen on.')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help='The number of query results to keep in memory.')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='Reload the report when it changes, checking every SECONDS.')
+    parser.add_argument('--update', action='store_true',
+                        help='Only read the rows added to the file since it was last loaded with --update.')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(BreachServer(args.file, args.cache_size, args.update), args.host, args.port, args.watch))
+    except KeyboardInterrupt:
+        pass